@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+
+"""asgi: Asynchronous Server Gateway Interface."""
+
+from __future__ import absolute_import
+from src.db_api_server.aio import APP
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+"""advisor: observed query shapes per table and missing-index candidates."""
+
+import threading
+
+# Operators an index can serve: equality first, then one range.
+EQUALITY_OPS = ('eq', 'in', 'is')
+RANGE_OPS = ('gt', 'gte', 'lt', 'lte', 'like')
+
+
+class Advisor:
+    """Record (database, table, filters, sort) shapes with their timings.
+
+    A shape is the filtered columns with their operators and the sort
+    columns, never the values; one sample (sql, params) per shape is
+    kept so the shape can be EXPLAINed later.
+    """
+
+    def __init__(self, max_shapes=1000):
+        """Initialize advisor.
+
+        Args:
+            max_shapes: Shapes tracked; new shapes beyond this are ignored
+        """
+        self.max_shapes = max_shapes
+        self.dropped = 0
+        self._shapes = {}
+        self._lock = threading.Lock()
+
+    def record(self, database, table, filters, sort, sql, params, seconds):
+        """Count one execution of a query shape that took seconds."""
+        key = (database, table, tuple(filters), tuple(sort))
+        with self._lock:
+            shape = self._shapes.get(key)
+            if shape is None:
+                if len(self._shapes) >= self.max_shapes:
+                    self.dropped += 1
+                    return
+                shape = self._shapes[key] = {'count': 0, 'total': 0.0, 'max': 0.0}
+            shape['count'] += 1
+            shape['total'] += seconds
+            shape['max'] = max(shape['max'], seconds)
+            shape['sample'] = (sql, tuple(params))
+
+    def shapes(self, database):
+        """Return database's shapes, most total time first."""
+        with self._lock:
+            items = [(key, dict(shape)) for key, shape in self._shapes.items() if key[0] == database]
+
+        result = []
+        for (_database, table, filters, sort), shape in items:
+            shape.update(table=table, filters=list(filters), sort=list(sort))
+            result.append(shape)
+        result.sort(key=lambda shape: shape['total'], reverse=True)
+        return result
+
+    def reset(self, database=None):
+        """Forget database's shapes (or all)."""
+        with self._lock:
+            for key in [key for key in self._shapes if database is None or key[0] == database]:
+                del self._shapes[key]
+
+
+def index_columns(rows):
+    """SHOW INDEX rows -> {index name: [column, ...] in index order}."""
+    indexes = {}
+    # Table, Non_unique, Key_name, Seq_in_index, Column_name, ...
+    for row in sorted(rows, key=lambda row: (row[2], row[3])):
+        indexes.setdefault(row[2], []).append(row[4])
+    return indexes
+
+
+def wanted_columns(filters, sort):
+    """Columns, in order, of the index that would serve filters then sort."""
+    equality = [column for column, op in filters if op in EQUALITY_OPS]
+    ranges = [column for column, op in filters if op in RANGE_OPS and column not in equality]
+    columns = []
+    for column in equality + ranges[:1]:
+        if column not in columns:
+            columns.append(column)
+    if not ranges:
+        # Sort columns after the equality ones save the filesort
+        columns += [column for column in sort if column not in columns]
+    return columns
+
+
+def missing_index(filters, sort, indexes):
+    """Suggested index columns if no index leads with a usable column, else None."""
+    columns = wanted_columns(filters, sort)
+    if not columns:
+        return None
+
+    usable = set(column.lower() for column, op in filters if op in EQUALITY_OPS + RANGE_OPS)
+    if not usable:
+        usable = {columns[0].lower()}
+
+    for index in indexes.values():
+        if index[0].lower() in usable:
+            return None
+    return columns
@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+
+"""aio: ASGI application with async RFID and attendance handlers.
+
+    uvicorn asgi:APP
+    gunicorn -k uvicorn.workers.UvicornWorker -w 1 asgi:APP
+
+GET /api/<database>/rfid/<rfidUID> and POST /api/<database>/attendance/log
+run as coroutines over aiomysql pools (one per connection config), so a
+single process can hold thousands of them open while MySQL answers.
+They share server.py's RFID index and cache invalidation and answer the
+same JSON. Every other request - and these two when aiomysql is not
+installed, credentials are missing or attendance is write-behind - is
+handed to the Flask app, which asgiref runs in a thread pool.
+"""
+
+import asyncio
+import base64
+import json
+import os
+import re
+from datetime import datetime
+
+from asgiref.wsgi import WsgiToAsgi
+from werkzeug.datastructures import Headers
+
+try:
+    import aiomysql
+except ImportError:
+    aiomysql = None
+
+from . import fastjson
+from . import pool
+from . import server
+
+POOL_MIN = int(os.environ.get('DB_API_AIO_POOL_MIN', '1'))
+POOL_MAX = int(os.environ.get('DB_API_AIO_POOL_MAX', '50'))
+POOL_RECYCLE = int(os.environ.get('DB_API_AIO_POOL_RECYCLE', '300'))
+
+RFID_RE = re.compile(r'^/api/([^/]+)/rfid/([^/]+)$')
+ATTENDANCE_RE = re.compile(r'^/api/([^/]+)/attendance/log$')
+
+WSGI = WsgiToAsgi(server.APP)
+
+# aiomysql pools by pool.pool_key(config); they belong to the serving event loop.
+_POOLS = {}
+# In-flight bulk loads of a missing RFID table, so a cold start loads it once.
+_RFID_LOADS = {}
+# Background reloads of expired RFID tables (referenced until done).
+_RFID_REFRESHES = set()
+
+
+def connect_args(config):
+    """aiomysql connect() arguments for a server.headers_config() config."""
+    return {'host': config['host'],
+            'port': config['port'],
+            'user': config['user'],
+            'password': config['password'],
+            'db': config['database'] or None,
+            'charset': config['charset'],
+            'connect_timeout': config['connection_timeout'],
+            'autocommit': False}
+
+
+async def get_pool(config):
+    """aiomysql pool for config, created on first use."""
+    key = pool.pool_key(config)
+    aio_pool = _POOLS.get(key)
+    if aio_pool is None:
+        aio_pool = await aiomysql.create_pool(minsize=POOL_MIN, maxsize=POOL_MAX,
+                                              pool_recycle=POOL_RECYCLE, **connect_args(config))
+        if key in _POOLS:
+            # Another request created it while this one was connecting
+            aio_pool.close()
+            await aio_pool.wait_closed()
+        else:
+            _POOLS[key] = aio_pool
+    return _POOLS[key]
+
+
+async def close_pools():
+    """Close every pool (lifespan shutdown)."""
+    pools = list(_POOLS.values())
+    _POOLS.clear()
+    for aio_pool in pools:
+        aio_pool.close()
+        await aio_pool.wait_closed()
+
+
+async def fetchall(config, sql, params=None):
+    """sql: async fetchall with params."""
+    async with (await get_pool(config)).acquire() as cnx:
+        async with cnx.cursor() as cur:
+            await cur.execute(sql, params)
+            rows = await cur.fetchall()
+        # End the read's transaction so the pooled connection drops its snapshot
+        await cnx.commit()
+    return rows
+
+
+async def fetchone(config, sql, params=None):
+    """sql: async fetchone with params."""
+    rows = await fetchall(config, sql, params)
+    return rows[0] if rows else None
+
+
+async def sqlexec(config, sql, values):
+    """sql: async exec values, return lastrowid."""
+    async with (await get_pool(config)).acquire() as cnx:
+        async with cnx.cursor() as cur:
+            await cur.execute(sql, values)
+            await cnx.commit()
+            return cur.lastrowid
+
+
+def credentials(headers):
+    """(user, password) from a Basic Authorization header, or None."""
+    scheme, _, token = headers.get('Authorization', '').partition(' ')
+    if scheme.lower() != 'basic' or not token:
+        return None
+    try:
+        user, _, password = base64.b64decode(token).decode('utf-8').partition(':')
+    except ValueError:
+        return None
+    return user, password
+
+
+async def send_json(send, headers, body, status):
+    """Send body as a complete JSON response (with the CORS headers Flask would add)."""
+    data = fastjson.dumps(body).encode('utf-8')
+    response = [(b'content-type', b'application/json'),
+                (b'content-length', str(len(data)).encode('ascii'))]
+    origin = headers.get('Origin')
+    if origin:
+        response += [(b'access-control-allow-origin', origin.encode('latin-1')),
+                     (b'access-control-allow-credentials', b'true'),
+                     (b'vary', b'Origin')]
+    await send({'type': 'http.response.start', 'status': status, 'headers': response})
+    await send({'type': 'http.response.body', 'body': data})
+
+
+async def send_error(send, headers, e):
+    """Send e the way server.handle_exception reports it."""
+    name = type(e).__name__
+    if name in ['OperationalError', 'InterfaceError', 'ProgrammingError']:
+        await send_json(send, headers, {'status': 512, 'errorType': name, 'errorMessage': str(e)}, 512)
+    else:
+        await send_json(send, headers, {'status': 500, 'errorType': 'Internal Server Error',
+                                        'errorMessage': str(e)}, 500)
+
+
+async def read_body(receive):
+    """Request body, all of it."""
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+
+async def rfid_table(config, key, database):
+    """rfid: rfid_uid -> row table for database (server.rfid_table, async)."""
+    table = server.RFID_INDEX.table(key)
+    if table is not None:
+        return table
+
+    table = server.RFID_INDEX.stale(key)
+    if table is not None:
+        # Serve the expired table; one task (or thread) reloads it.
+        lock = server.RFID_INDEX.refresh_lock(key)
+        if lock.acquire(blocking=False):
+            task = asyncio.ensure_future(refresh_rfid_table(config, key, database, lock))
+            _RFID_REFRESHES.add(task)
+            task.add_done_callback(_RFID_REFRESHES.discard)
+        return table
+
+    load = _RFID_LOADS.get(key)
+    if load is None:
+        load = _RFID_LOADS[key] = asyncio.ensure_future(load_rfid_table(config, key, database))
+        try:
+            return await load
+        finally:
+            del _RFID_LOADS[key]
+    return await load
+
+
+async def load_rfid_table(config, key, database):
+    """rfid: read user_rfid in one query and install it."""
+    stamp = server.RFID_INDEX.stamp()
+    sql = "SELECT user_id, rfid_uid, type FROM " + database + ".user_rfid"
+    table = server.rfid_table_from_rows(await fetchall(config, sql))
+    server.RFID_INDEX.load(key, table, stamp)
+    return table
+
+
+async def refresh_rfid_table(config, key, database, lock):
+    """rfid: background reload of an expired table; releases lock when done."""
+    try:
+        await load_rfid_table(config, key, database)
+    except Exception as e:  # pylint: disable=broad-except
+        print(f"Error refreshing RFID table for {database}: {e}")
+    finally:
+        lock.release()
+
+
+async def get_user_by_rfid(send, headers, config, database, rfid_uid):
+    """GET: /api/<database>/rfid/<rfidUID> (server.get_user_by_rfid, async)."""
+    key = (pool.pool_key(config), database)
+    row = server.RFID_INDEX.lookup(await rfid_table(config, key, database), rfid_uid)
+
+    if row is None and not server.RFID_INDEX.is_negative(key, rfid_uid):
+        sql = "SELECT user_id, rfid_uid, type FROM " + database + ".user_rfid WHERE rfid_uid=%s LIMIT 1"
+        row = await fetchone(config, sql, (rfid_uid,))
+        server.RFID_INDEX.add(key, rfid_uid, row)
+
+    if row:
+        await send_json(send, headers, {"user_id": row[0], "rfid_uid": row[1], "type": row[2]}, 200)
+    else:
+        await send_json(send, headers, {'status': 404, 'message': "Not Found"}, 404)
+
+
+async def log_user_attendance(send, headers, receive, config, database):
+    """POST: /api/<database>/attendance/log (server.log_user_attendance, async)."""
+    mimetype = headers.get('Content-Type', '').split(';')[0].strip().lower()
+    if mimetype != 'application/json' and not mimetype.endswith('+json'):
+        await send_json(send, headers, {'status': 400,
+                                        'message': "Content-Type must be application/json"}, 400)
+        return
+
+    try:
+        data = json.loads(await read_body(receive))
+    except ValueError as e:
+        await send_json(send, headers, {'status': 400, 'errorType': "HTTP Exception",
+                                        'errorMessage': "Failed to decode JSON object: " + str(e)}, 400)
+        return
+
+    user_id = data.get('userID') if isinstance(data, dict) else None
+    primary_email = data.get('primaryEmail') if isinstance(data, dict) else None
+    if not user_id or not primary_email:
+        await send_json(send, headers, {'status': 400,
+                                        'message': "Missing required fields: userID and primaryEmail"}, 400)
+        return
+
+    try:
+        login_time = datetime.now()
+        sql = (
+            "INSERT INTO " + database + ".user_attendance "
+            "(user_id, primary_email, login_time) VALUES (%s, %s, %s)"
+        )
+        attendance_id = await sqlexec(config, sql, (user_id, primary_email, login_time))
+        # Invalidation may write the shared SQLite result cache: off the event loop.
+        await asyncio.get_running_loop().run_in_executor(None, server.table_written,
+                                                         database, 'user_attendance')
+    except Exception as e:  # pylint: disable=broad-except
+        await send_json(send, headers, {'status': 500, 'message': str(e)}, 500)
+        return
+
+    await send_json(send, headers, {'status': 201,
+                                    'message': "Attendance logged",
+                                    'id': attendance_id,
+                                    'loginTime': login_time.isoformat()}, 201)
+
+
+async def lifespan(receive, send):
+    """ASGI lifespan: nothing to start; close the pools on shutdown."""
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await close_pools()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def APP(scope, receive, send):  # pylint: disable=invalid-name
+    """ASGI entry point."""
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+
+    path, method = scope['path'], scope['method']
+    rfid = RFID_RE.match(path) if method == 'GET' else None
+    attendance = ATTENDANCE_RE.match(path) if method == 'POST' else None
+    if rfid and rfid.group(2) == 'users':
+        rfid = None
+    if attendance and server.ATTENDANCE_WRITE_BEHIND:
+        attendance = None
+
+    headers = Headers([(name.decode('latin-1'), value.decode('latin-1'))
+                       for name, value in scope['headers']])
+    user = credentials(headers) if (rfid or attendance) and aiomysql is not None else None
+    if user is None:
+        await WSGI(scope, receive, send)
+        return
+
+    try:
+        config = server.headers_config(headers, *user)
+        if rfid:
+            await get_user_by_rfid(send, headers, config, rfid.group(1), rfid.group(2))
+        else:
+            await log_user_attendance(send, headers, receive, config, attendance.group(1))
+    except Exception as e:  # pylint: disable=broad-except
+        await send_error(send, headers, e)
@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+
+"""cache: in-process TTL + LRU caches."""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """Thread-safe LRU mapping whose entries also expire after ttl seconds."""
+
+    def __init__(self, maxsize=1024, ttl=60.0):
+        """Initialize cache.
+
+        Args:
+            maxsize: Maximum number of entries before the least recently used is dropped
+            ttl: Seconds an entry stays valid
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Return the live value for key, or default."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < now:
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, ttl=None):
+        """Store value under key."""
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        """Drop key if present."""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def invalidate(self, predicate=None):
+        """Drop every entry, or those whose key satisfies predicate."""
+        with self._lock:
+            if predicate is None:
+                self._data.clear()
+                return
+            for key in [key for key in self._data if predicate(key)]:
+                del self._data[key]
+
+    def stats(self):
+        """Return size and hit/miss counters."""
+        with self._lock:
+            return {'size': len(self._data),
+                    'maxsize': self.maxsize,
+                    'ttl': self.ttl,
+                    'hits': self.hits,
+                    'misses': self.misses}
+
+
+class LookupIndex:
+    """Bulk-loaded in-memory lookup tables with negative caching.
+
+    Each table is a dict loaded in one query and reloaded after ttl
+    seconds or once invalidated; lookups missing from a table can be
+    remembered as negative for negative_ttl seconds. An expired table
+    stays available through stale() until its reload is installed, and
+    refresh_lock(key) lets one caller at a time do that reload.
+    """
+
+    def __init__(self, ttl=60.0, negative_ttl=5.0, negative_size=10000):
+        """Initialize index.
+
+        Args:
+            ttl: Seconds a loaded table is served before it is reloaded
+            negative_ttl: Seconds an unknown lookup is remembered as missing
+            negative_size: Maximum number of remembered misses
+        """
+        self.ttl = ttl
+        self.loads = 0
+        self.hits = 0
+        self.misses = 0
+        self._tables = {}
+        self._refresh_locks = {}
+        self._stamp = 0
+        self._negative = TTLCache(maxsize=negative_size, ttl=negative_ttl)
+        self._lock = threading.Lock()
+
+    def table(self, key):
+        """Return the live table for key, or None if it must be (re)loaded."""
+        with self._lock:
+            entry = self._tables.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                return None
+            return entry[1]
+
+    def stale(self, key):
+        """Return the table for key even if expired; None once invalidated."""
+        with self._lock:
+            entry = self._tables.get(key)
+            return None if entry is None else entry[1]
+
+    def refresh_lock(self, key):
+        """Return the lock to hold while reloading the table for key."""
+        with self._lock:
+            return self._refresh_locks.setdefault(key, threading.Lock())
+
+    def stamp(self):
+        """Return a token for load(), taken before the table is read."""
+        with self._lock:
+            return self._stamp
+
+    def load(self, key, table, stamp=None):
+        """Install a freshly loaded table for key.
+
+        stamp: from stamp(); the table is dropped if an invalidation
+        happened since, as it may predate the write
+        """
+        with self._lock:
+            if stamp is not None and stamp != self._stamp:
+                return
+            self._tables[key] = (time.monotonic() + self.ttl, table)
+            self.loads += 1
+        self._negative.invalidate(lambda negative: negative[0] == key)
+
+    def lookup(self, table, name):
+        """Return table[name], or None, counting the hit or miss."""
+        value = table.get(name)
+        with self._lock:
+            if value is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return value
+
+    def is_negative(self, key, name):
+        """True if name was recently looked up in the database and not found."""
+        return self._negative.get((key, name)) is not None
+
+    def add(self, key, name, value):
+        """Record a row found after load, or a miss when value is None."""
+        if value is None:
+            self._negative.set((key, name), True)
+            return
+        with self._lock:
+            entry = self._tables.get(key)
+            if entry is not None:
+                entry[1][name] = value
+
+    def invalidate(self, predicate=None):
+        """Force a reload of every table, or of those whose key satisfies predicate."""
+        with self._lock:
+            self._stamp += 1
+            for key in list(self._tables):
+                if predicate is None or predicate(key):
+                    del self._tables[key]
+        if predicate is None:
+            self._negative.invalidate()
+        else:
+            self._negative.invalidate(lambda negative: predicate(negative[0]))
+
+    def stats(self):
+        """Return table count and hit/miss counters."""
+        with self._lock:
+            return {'tables': len(self._tables),
+                    'rows': sum(len(entry[1]) for entry in self._tables.values()),
+                    'ttl': self.ttl,
+                    'loads': self.loads,
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'negative': self._negative.stats()}
+
+
+class BlobCache:
+    """Thread-safe LRU of binary values bounded by their total size in bytes.
+
+    Values are (..., data) tuples whose last item is the bytes counted
+    against max_bytes; entries also expire after ttl seconds.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, ttl=300.0):
+        """Initialize cache.
+
+        Args:
+            max_bytes: Byte budget; least recently used entries are dropped beyond it
+            ttl: Seconds an entry stays valid
+        """
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Return the live value for key, or default."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < now:
+                if entry is not None:
+                    self._drop(key)
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        """Store value under key unless its data alone exceeds the budget."""
+        size = len(value[-1])
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._data:
+                self._drop(key)
+            self._data[key] = (time.monotonic() + self.ttl, value, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                self._drop(next(iter(self._data)))
+                self.evictions += 1
+
+    def _drop(self, key):
+        """Remove key; caller holds the lock."""
+        self.bytes -= self._data.pop(key)[2]
+
+    def invalidate(self, predicate=None):
+        """Drop every entry, or those for which predicate(key, value) is true."""
+        with self._lock:
+            if predicate is None:
+                self._data.clear()
+                self.bytes = 0
+                return
+            for key in [key for key, entry in self._data.items() if predicate(key, entry[1])]:
+                self._drop(key)
+
+    def stats(self):
+        """Return size and hit/miss counters."""
+        with self._lock:
+            return {'size': len(self._data),
+                    'bytes': self.bytes,
+                    'maxBytes': self.max_bytes,
+                    'ttl': self.ttl,
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions}
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+
+"""compress: Accept-Encoding negotiated response compression (gzip, br, zstd)."""
+
+import os
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+ENABLED = os.environ.get('DB_API_COMPRESS', '1').lower() not in ['0', 'false', 'no']
+# Buffered bodies smaller than this are sent as is; streamed bodies are always compressed.
+MIN_SIZE = int(os.environ.get('DB_API_COMPRESS_MIN_SIZE', '1024'))
+GZIP_LEVEL = int(os.environ.get('DB_API_GZIP_LEVEL', '6'))
+BROTLI_QUALITY = int(os.environ.get('DB_API_BROTLI_QUALITY', '5'))
+ZSTD_LEVEL = int(os.environ.get('DB_API_ZSTD_LEVEL', '3'))
+
+# Server preference among encodings the client weights equally.
+ENCODINGS = [name for name, available in [('zstd', zstandard is not None),
+                                          ('br', brotli is not None),
+                                          ('gzip', True)] if available]
+
+# Already compressed media; everything else textual is worth compressing.
+_SKIP_TYPES = ('image/', 'video/', 'audio/')
+_SKIP_EXCEPT = ('image/svg+xml', 'image/bmp')
+_SKIP_MIMETYPES = ('application/zip', 'application/gzip', 'application/x-gzip',
+                   'application/octet-stream', 'application/pdf',
+                   'application/vnd.apache.parquet')
+
+
+class _Gzip:
+    """Incremental gzip stream."""
+
+    def __init__(self):
+        self._z = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def chunk(self, data):
+        """Compress data and flush it so the client can decode it now."""
+        return self._z.compress(data) + self._z.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        """Return the end of the stream."""
+        return self._z.flush()
+
+
+class _Brotli:
+    """Incremental brotli stream."""
+
+    def __init__(self):
+        self._z = brotli.Compressor(quality=BROTLI_QUALITY)
+
+    def chunk(self, data):
+        """Compress data and flush it so the client can decode it now."""
+        return self._z.process(data) + self._z.flush()
+
+    def finish(self):
+        """Return the end of the stream."""
+        return self._z.finish()
+
+
+class _Zstd:
+    """Incremental zstd stream."""
+
+    def __init__(self):
+        self._z = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+
+    def chunk(self, data):
+        """Compress data and flush it so the client can decode it now."""
+        return self._z.compress(data) + self._z.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self):
+        """Return the end of the stream."""
+        return self._z.flush()
+
+
+_COMPRESSORS = {'gzip': _Gzip, 'br': _Brotli, 'zstd': _Zstd}
+
+
+def compressible(response):
+    """True if response is a kind worth compressing."""
+    if not ENABLED or response.direct_passthrough:
+        return False
+    if response.status_code < 200 or response.status_code in (204, 206, 304):
+        return False
+    if 'Content-Encoding' in response.headers:
+        return False
+    mimetype = response.mimetype or ''
+    if mimetype.startswith(_SKIP_TYPES) and mimetype not in _SKIP_EXCEPT:
+        return False
+    return mimetype not in _SKIP_MIMETYPES
+
+
+def compress_response(response, accept_encodings):
+    """Compress response for a client sending accept_encodings (werkzeug Accept).
+
+    Buffered bodies of at least MIN_SIZE bytes are compressed in one go;
+    streamed bodies are compressed chunk by chunk as they are produced.
+    """
+    if not compressible(response):
+        return response
+
+    streamed = response.is_streamed
+    if not streamed and response.content_length is not None and response.content_length < MIN_SIZE:
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = accept_encodings.best_match(ENCODINGS)
+    if not encoding:
+        return response
+
+    compressor = _COMPRESSORS[encoding]()
+    if streamed:
+        response.response = _stream(compressor, response.iter_encoded(), response.response)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < MIN_SIZE:
+            return response
+        response.set_data(compressor.chunk(data) + compressor.finish())
+
+    response.headers['Content-Encoding'] = encoding
+
+    # The compressed bytes are a different representation of the same content
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def _stream(compressor, chunks, source):
+    """Yield compressed chunks, closing source (the original iterable) at the end."""
+    try:
+        for data in chunks:
+            if data:
+                yield compressor.chunk(data)
+        yield compressor.finish()
+    finally:
+        if hasattr(source, 'close'):
+            source.close()
@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+
+"""export: CSV, Arrow IPC and Parquet encodings of cursor batches.
+
+Arrow and Parquet need pyarrow; their schema comes from the cursor
+description and each cursor batch (a list of row tuples) becomes one
+record batch, column by column.
+"""
+
+import csv
+import io
+import os
+
+from mysql.connector.constants import FieldFlag
+from mysql.connector.constants import FieldType
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+MIMETYPES = {'json': 'application/json',
+             'ndjson': 'application/x-ndjson',
+             'csv': 'text/csv',
+             'arrow': 'application/vnd.apache.arrow.stream',
+             'parquet': 'application/vnd.apache.parquet'}
+NEEDS_PYARROW = ('arrow', 'parquet')
+# Rows per Parquet row group (cursor batches are gathered up to this).
+PARQUET_ROW_GROUP = int(os.environ.get('DB_API_PARQUET_ROW_GROUP', '65536'))
+
+_BINARY_CHARSET = 63
+_STRING_TYPES = (FieldType.VARCHAR, FieldType.VAR_STRING, FieldType.STRING, FieldType.ENUM,
+                 FieldType.TINY_BLOB, FieldType.MEDIUM_BLOB, FieldType.LONG_BLOB, FieldType.BLOB)
+
+
+def negotiate(fmt, accept):
+    """Return the export format asked for by ?format= or the Accept header, or None."""
+    fmt = (fmt or '').lower()
+    if fmt in MIMETYPES:
+        return fmt
+    if fmt:
+        return None
+    for name, mimetype in MIMETYPES.items():
+        if name != 'json' and mimetype in accept:
+            return name
+    return None
+
+
+def _is_binary(column):
+    """True if a string/blob column holds bytes rather than text."""
+    if len(column) > 8 and column[8] is not None:
+        return column[8] == _BINARY_CHARSET
+    return bool(column[7] & FieldFlag.BINARY)
+
+
+def _text(value):
+    """Column value as text (bytes decoded, SET joined)."""
+    if isinstance(value, (bytes, bytearray)):
+        return value.decode('utf-8', errors='replace')
+    if isinstance(value, set):
+        return ','.join(sorted(value))
+    return value
+
+
+def _bytes(value):
+    """Column value as bytes."""
+    if isinstance(value, bytearray):
+        return bytes(value)
+    if isinstance(value, str):
+        return value.encode('utf-8')
+    return value
+
+
+def csv_stream(description, batches):
+    """Yield a CSV document (header row first) batch by batch."""
+    # Text for string columns; Decimal, dates, numbers via str(); NULL as empty.
+    convert = [_text if column[1] in _STRING_TYPES + (FieldType.JSON, FieldType.SET) else None
+               for column in description]
+    if not any(convert):
+        convert = None
+
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow([column[0] for column in description])
+    try:
+        for batch in batches:
+            if convert:
+                batch = [[f(v) if f and v is not None else v for f, v in zip(convert, row)]
+                         for row in batch]
+            writer.writerows(batch)
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+        yield buf.getvalue()
+    finally:
+        batches.close()
+
+
+def _arrow_type(column, sample):
+    """(pyarrow type, value converter or None) for a cursor description entry."""
+    type_code, flags = column[1], column[7]
+    unsigned = bool(flags & FieldFlag.UNSIGNED)
+    ints = {FieldType.TINY: (pyarrow.int8(), pyarrow.uint8()),
+            FieldType.SHORT: (pyarrow.int16(), pyarrow.uint16()),
+            FieldType.INT24: (pyarrow.int32(), pyarrow.uint32()),
+            FieldType.LONG: (pyarrow.int32(), pyarrow.uint32()),
+            FieldType.LONGLONG: (pyarrow.int64(), pyarrow.uint64()),
+            FieldType.YEAR: (pyarrow.int16(), pyarrow.int16())}
+
+    if type_code in ints:
+        return ints[type_code][unsigned], None
+    if type_code == FieldType.BIT:
+        return pyarrow.uint64(), None
+    if type_code == FieldType.FLOAT:
+        return pyarrow.float32(), None
+    if type_code == FieldType.DOUBLE:
+        return pyarrow.float64(), None
+    if type_code in (FieldType.DECIMAL, FieldType.NEWDECIMAL):
+        # The description carries no scale; a column's values all share it.
+        scale = -sample.as_tuple().exponent if sample is not None else 10
+        return pyarrow.decimal128(38, max(scale, 0)), None
+    if type_code in (FieldType.DATE, FieldType.NEWDATE):
+        return pyarrow.date32(), None
+    if type_code in (FieldType.DATETIME, FieldType.TIMESTAMP):
+        return pyarrow.timestamp('us'), None
+    if type_code == FieldType.TIME:
+        return pyarrow.duration('us'), None
+    if type_code == FieldType.NULL:
+        return pyarrow.null(), None
+    if type_code == FieldType.GEOMETRY:
+        return pyarrow.binary(), _bytes
+    if type_code in _STRING_TYPES and _is_binary(column):
+        return pyarrow.binary(), _bytes
+    return pyarrow.string(), _text
+
+
+def arrow_schema(description, rows):
+    """pyarrow schema and per-column converters, using rows to settle decimal scales."""
+    fields, converters = [], []
+    for i, column in enumerate(description):
+        sample = next((row[i] for row in rows if row[i] is not None), None)
+        arrow_type, convert = _arrow_type(column, sample)
+        fields.append(pyarrow.field(column[0], arrow_type, nullable=True))
+        converters.append(convert)
+    return pyarrow.schema(fields), converters
+
+
+def _record_batch(schema, converters, rows):
+    """Transpose row tuples into one pyarrow RecordBatch."""
+    if rows:
+        columns = list(zip(*rows))
+    else:
+        columns = [()] * len(schema)
+    arrays = []
+    for values, field, convert in zip(columns, schema, converters):
+        if convert:
+            values = [convert(v) if v is not None else None for v in values]
+        arrays.append(pyarrow.array(values, type=field.type))
+    return pyarrow.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+class _Sink:
+    """Write-only file collecting output so it can be yielded in pieces."""
+
+    closed = False
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def write(self, data):
+        """Collect data."""
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        """Bytes written so far."""
+        return self.position
+
+    def flush(self):
+        """Nothing buffered here."""
+
+    def close(self):
+        """Mark closed."""
+        self.closed = True
+
+    def drain(self):
+        """Return and forget what has been written since the last drain."""
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def arrow_stream(description, batches, fmt='arrow'):
+    """Yield an Arrow IPC stream (or a Parquet file) batch by batch."""
+    try:
+        first = next(batches, [])
+        schema, converters = arrow_schema(description, first)
+        sink = _Sink()
+
+        if fmt == 'parquet':
+            writer = pyarrow.parquet.ParquetWriter(pyarrow.PythonFile(sink, mode='w'), schema)
+            group = [_record_batch(schema, converters, first)] if first else []
+            rows = len(first)
+            for batch in batches:
+                group.append(_record_batch(schema, converters, batch))
+                rows += len(batch)
+                if rows >= PARQUET_ROW_GROUP:
+                    writer.write_table(pyarrow.Table.from_batches(group, schema=schema))
+                    group, rows = [], 0
+                    yield sink.drain()
+            if group:
+                writer.write_table(pyarrow.Table.from_batches(group, schema=schema))
+            writer.close()
+            yield sink.drain()
+            return
+
+        writer = pyarrow.ipc.new_stream(sink, schema)
+        if first:
+            writer.write_batch(_record_batch(schema, converters, first))
+            yield sink.drain()
+        for batch in batches:
+            writer.write_batch(_record_batch(schema, converters, batch))
+            yield sink.drain()
+        writer.close()
+        yield sink.drain()
+    finally:
+        batches.close()
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+
+"""fastjson: response JSON encoding, using orjson when it is installed."""
+
+import decimal
+import json
+import os
+import uuid
+from datetime import date, datetime, timezone
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    from flask.json.provider import JSONProvider
+except ImportError:  # Flask < 2.2: the app falls back to json_encoder
+    JSONProvider = object
+
+from flask import has_request_context
+from flask import request
+
+
+# auto (orjson if installed) | orjson | json
+BACKEND = os.environ.get('DB_API_JSON_BACKEND', 'auto').lower()
+USE_ORJSON = orjson is not None and BACKEND in ['auto', 'orjson']
+# Pretty-print every response, not only those asking for ?pretty=1
+PRETTY = os.environ.get('DB_API_JSON_PRETTY', '').lower() in ['1', 'true', 'yes']
+
+# First characters of a JSON text that json.loads can accept.
+_JSON_START = frozenset('{["-0123456789tfn')
+_DAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+_MONTHS = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+
+
+def http_date(o):
+    """Format a date or datetime like werkzeug.http.http_date (naive means UTC), faster."""
+    if isinstance(o, datetime):
+        if o.tzinfo is not None:
+            o = o.astimezone(timezone.utc)
+        hms = (o.hour, o.minute, o.second)
+    else:
+        hms = (0, 0, 0)
+    return '%s, %02d %s %04d %02d:%02d:%02d GMT' % ((_DAYS[o.weekday()], o.day, _MONTHS[o.month - 1], o.year)
+                                                    + hms)
+
+
+def default(o):
+    """Encode the values json and orjson do not handle themselves.
+
+    Decimal -> str; bytes -> embedded JSON if the bytes hold a JSON
+    text, else the decoded string (repr if not UTF-8); bytearray ->
+    decoded string; date/datetime -> HTTP date (as Flask does); UUID -> str.
+    """
+    if isinstance(o, decimal.Decimal):
+        return str(o)
+
+    if isinstance(o, bytes):
+        try:
+            text = o.decode('utf-8')
+        except UnicodeDecodeError:
+            return str(o)
+        # Skip the json.loads attempt (and its exception) for plain text
+        if text.lstrip()[:1] in _JSON_START:
+            try:
+                return json.loads(text)
+            except json.decoder.JSONDecodeError:
+                pass
+        return text
+
+    if isinstance(o, bytearray):
+        return o.decode('utf-8')
+
+    if isinstance(o, date):
+        return http_date(o)
+
+    if isinstance(o, uuid.UUID):
+        return str(o)
+
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+class AppJSONEncoder(json.JSONEncoder):
+    """app: json encoder."""
+
+    def default(self, o):
+        """default: self."""
+        return default(o)
+
+
+if orjson is not None:
+    # Dates go through default() so they keep Flask's HTTP date format
+    _ORJSON_OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME
+    _ORJSON_PRETTY = _ORJSON_OPTIONS | orjson.OPT_INDENT_2
+
+
+def dumps(obj, pretty=False):
+    """Serialize obj to a JSON str, compact unless pretty."""
+    if USE_ORJSON:
+        try:
+            return orjson.dumps(obj, default=default,
+                                option=_ORJSON_PRETTY if pretty else _ORJSON_OPTIONS).decode('utf-8')
+        except orjson.JSONEncodeError:
+            # Integers beyond 64 bits, non-str dict keys, ...: let json decide
+            pass
+
+    if pretty:
+        return json.dumps(obj, cls=AppJSONEncoder, indent=2)
+    return json.dumps(obj, cls=AppJSONEncoder, separators=(',', ':'))
+
+
+def wants_pretty():
+    """True if the current response should be pretty-printed (?pretty=1)."""
+    if PRETTY:
+        return True
+    return has_request_context() and request.args.get('pretty', '').lower() in ['1', 'true', 'yes']
+
+
+class AppJSONProvider(JSONProvider):
+    """Flask JSON provider: fastjson for jsonify() and the json module for requests."""
+
+    def dumps(self, obj, **kwargs):
+        """Serialize obj to a JSON str."""
+        return dumps(obj, pretty=bool(kwargs.get('indent')))
+
+    def loads(self, s, **kwargs):
+        """Deserialize a JSON str or bytes."""
+        return json.loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        """Return a JSON response, pretty-printed on request."""
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps(obj, pretty=wants_pretty()) + "\n",
+                                        mimetype='application/json')
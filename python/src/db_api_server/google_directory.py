@@ -4,6 +4,8 @@
 
 import os
 import base64
+import threading
+import time
 from typing import List, Dict, Optional, Tuple
 
 from google.oauth2 import service_account
@@ -18,30 +20,66 @@ SCOPES = [
 ]
 
 
+class RateLimiter:
+    """Thread-safe limiter spacing calls evenly at a fixed rate."""
+
+    def __init__(self, rate: float):
+        """Initialize rate limiter.
+
+        Args:
+            rate: Calls per second (0 or less disables limiting)
+        """
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        """Block until the next call is allowed."""
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
 class GoogleDirectoryClient:
-    """Client for Google Workspace Directory API."""
+    """Client for Google Workspace Directory API.
+
+    Safe to share between threads: each thread builds its own service
+    (httplib2 connections are not thread-safe).
+    """
 
-    def __init__(self, credentials_path: str, delegated_user_email: str):
+    def __init__(self, credentials_path: str, delegated_user_email: str,
+                 num_retries: int = 5, rate: float = 0):
         """Initialize Google Directory API client.
         
         Args:
             credentials_path: Path to service account JSON credentials file
             delegated_user_email: Email of admin user to impersonate
+            num_retries: Retries with exponential backoff on 429/5xx responses
+            rate: Maximum photo requests per second across threads (0 = unlimited)
         """
         self.credentials_path = credentials_path
         self.delegated_user_email = delegated_user_email
-        self.service = None
+        self.num_retries = num_retries
+        self.rate_limiter = RateLimiter(rate)
+        self._local = threading.local()
         
     def _get_service(self):
-        """Get or create Directory API service instance."""
-        if self.service is None:
+        """Get or create this thread's Directory API service instance."""
+        service = getattr(self._local, 'service', None)
+        if service is None:
             credentials = service_account.Credentials.from_service_account_file(
                 self.credentials_path,
                 scopes=SCOPES,
                 subject=self.delegated_user_email
             )
-            self.service = build('admin', 'directory_v1', credentials=credentials)
-        return self.service
+            service = build('admin', 'directory_v1', credentials=credentials)
+            self._local.service = service
+        return service
     
     def list_all_users(self, customer: str = 'my_customer') -> List[Dict]:
         """Retrieve all users from Google Workspace.
@@ -64,7 +102,7 @@ class GoogleDirectoryClient:
                     orderBy='email',
                     projection='full',
                     pageToken=page_token
-                ).execute()
+                ).execute(num_retries=self.num_retries)
                 
                 users_page = results.get('users', [])
                 for user in users_page:
@@ -95,7 +133,7 @@ class GoogleDirectoryClient:
             user = service.users().get(
                 userKey=user_key,
                 projection='full'
-            ).execute()
+            ).execute(num_retries=self.num_retries)
             
             return self._extract_user_fields(user)
             
@@ -117,7 +155,9 @@ class GoogleDirectoryClient:
         service = self._get_service()
         
         try:
-            photo = service.users().photos().get(userKey=user_key).execute()
+            self.rate_limiter.wait()
+            photo = service.users().photos().get(userKey=user_key).execute(
+                num_retries=self.num_retries)
 
             photo_data_str = photo.get('photoData', '')
             if not photo_data_str:
@@ -202,6 +242,8 @@ def create_client_from_env() -> Optional[GoogleDirectoryClient]:
     Environment variables:
         GOOGLE_CREDENTIALS_PATH: Path to service account JSON file
         GOOGLE_DELEGATED_USER: Email of admin user to impersonate
+        GOOGLE_NUM_RETRIES: Retries on 429/5xx responses (default 5)
+        GOOGLE_PHOTO_RATE: Photo requests per second (default 10, 0 = unlimited)
         
     Returns:
         GoogleDirectoryClient instance or None if env vars not set
@@ -216,4 +258,6 @@ def create_client_from_env() -> Optional[GoogleDirectoryClient]:
         print(f'Credentials file not found: {credentials_path}')
         return None
     
-    return GoogleDirectoryClient(credentials_path, delegated_user)
+    return GoogleDirectoryClient(credentials_path, delegated_user,
+                                 num_retries=int(os.environ.get('GOOGLE_NUM_RETRIES', '5')),
+                                 rate=float(os.environ.get('GOOGLE_PHOTO_RATE', '10')))
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+"""jobs: background job runner, single-flight per database."""
+
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+
+class Job:
+    """A background job and its live progress counters."""
+
+    def __init__(self, database, kind):
+        """Initialize job.
+
+        Args:
+            database: Database the job works on
+            kind: Job type, e.g. 'full' or 'photo'
+        """
+        self.id = None
+        self.database = database
+        self.kind = kind
+        self.status = 'queued'
+        self.error = None
+        self.progress = {}
+        self.started = datetime.now()
+        self.finished = None
+
+    def to_dict(self):
+        """Return a JSON-serializable view of the job."""
+        return {'id': self.id,
+                'database': self.database,
+                'syncType': self.kind,
+                'status': self.status,
+                'error': self.error,
+                'progress': dict(self.progress),
+                'startedAt': self.started.isoformat(),
+                'completedAt': self.finished.isoformat() if self.finished else None}
+
+
+class JobRunner:
+    """Run jobs on a thread pool, at most one at a time per database."""
+
+    def __init__(self, max_workers=2, history=100):
+        """Initialize runner.
+
+        Args:
+            max_workers: Jobs run concurrently (across databases)
+            history: Finished jobs kept for status lookups
+        """
+        self.history = history
+        self._executor = None
+        self._max_workers = max_workers
+        self._running = {}
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def reserve(self, database, kind):
+        """Claim database for a new job.
+
+        Returns (job, True) for a new job, or (running job, False) if one is
+        already running for database.
+        """
+        with self._lock:
+            job = self._running.get(database)
+            if job is not None:
+                return job, False
+            job = self._running[database] = Job(database, kind)
+            return job, True
+
+    def release(self, job):
+        """Give up a reservation that will not be started."""
+        with self._lock:
+            if self._running.get(job.database) is job:
+                del self._running[job.database]
+
+    def start(self, job, job_id, target, *args):
+        """Run target(job, *args) in the background under job_id."""
+        job.id = job_id
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self._max_workers,
+                                                    thread_name_prefix='job')
+            # Ids are log row ids of each database's own table
+            self._jobs[(job.database, job_id)] = job
+            while len(self._jobs) > self.history:
+                self._jobs.popitem(last=False)
+        self._executor.submit(self._run, job, target, args)
+
+    def _run(self, job, target, args):
+        """Execute one job, recording its outcome."""
+        job.status = 'running'
+        try:
+            target(job, *args)
+            job.status = 'completed'
+        except Exception as e:  # pylint: disable=broad-except
+            job.status = 'failed'
+            job.error = str(e)
+        finally:
+            job.finished = datetime.now()
+            self.release(job)
+
+    def get(self, database, job_id):
+        """Return the job with job_id for database, if this process knows it."""
+        with self._lock:
+            return self._jobs.get((database, job_id))
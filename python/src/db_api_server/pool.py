@@ -0,0 +1,317 @@
+# -*- coding: utf-8 -*-
+
+"""pool: per-credential mysql connection pool."""
+
+import hashlib
+import os
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from collections import deque
+
+import mysql.connector
+from mysql.connector.errors import PoolError
+
+
+POOL_ENABLED = os.environ.get('DB_API_POOL', '1').lower() not in ['0', 'false', 'no']
+POOL_SIZE = int(os.environ.get('DB_API_POOL_SIZE', '8'))
+POOL_IDLE = float(os.environ.get('DB_API_POOL_IDLE', '300'))
+POOL_PING = float(os.environ.get('DB_API_POOL_PING', '1'))
+POOL_TIMEOUT = float(os.environ.get('DB_API_POOL_TIMEOUT', '10'))
+# Server-side prepared statements kept per pooled connection (0 disables).
+STMT_CACHE = int(os.environ.get('DB_API_STMT_CACHE', '32'))
+
+
+class PooledConnection:
+    """Connection checked out of a ConnectionPool.
+
+    Attribute access is delegated to the underlying mysql.connector
+    connection; close() hands the connection back to its pool instead
+    of closing the socket.
+    """
+
+    def __init__(self, pool, cnx):
+        """Wrap cnx, owned by pool."""
+        self._pool = pool
+        self._cnx = cnx
+
+    def __getattr__(self, attr):
+        """Delegate to the underlying connection."""
+        cnx = self.__dict__.get('_cnx')
+        if cnx is None or attr.startswith('__'):
+            raise AttributeError(attr)
+        return getattr(cnx, attr)
+
+    def close(self, discard=False, reset=False):
+        """Return the connection to the pool (or close it for good when discard).
+
+        reset: clear the session first (see ConnectionPool.release)
+        """
+        cnx = self.__dict__.get('_cnx')
+        if cnx is None:
+            return
+        self._cnx = None
+        self._pool.release(cnx, discard, reset)
+
+    def __del__(self):
+        """Give the slot back if a caller never closed the connection."""
+        self.close()
+
+
+class ConnectionPool:
+    """Bounded pool of connections sharing one connect config."""
+
+    def __init__(self, config, size=POOL_SIZE, idle=POOL_IDLE, ping=POOL_PING):
+        """Initialize pool.
+
+        Args:
+            config: Keyword arguments for mysql.connector.connect()
+            size: Maximum number of open connections (idle + checked out)
+            idle: Seconds an idle connection is kept before eviction
+            ping: Seconds idle after which a connection is pinged on checkout
+        """
+        self.config = config
+        self.size = size
+        self.idle = idle
+        self.ping = ping
+        self.checked_out = 0
+        self._free = deque()
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def acquire(self, timeout=POOL_TIMEOUT):
+        """Check out a healthy connection, opening one if none is idle."""
+        if not self._slots.acquire(timeout=timeout):
+            raise PoolError("Connection pool exhausted (size %d)" % self.size)
+
+        try:
+            cnx = self._checkout()
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self.checked_out += 1
+        return PooledConnection(self, cnx)
+
+    def _checkout(self):
+        """Pop the most recently used idle connection or connect."""
+        while True:
+            with self._lock:
+                if not self._free:
+                    break
+                cnx, last_used = self._free.pop()
+
+            idle_for = time.monotonic() - last_used
+            if idle_for > self.idle:
+                _close_quietly(cnx)
+                continue
+
+            if idle_for > self.ping and not cnx.is_connected():
+                _close_quietly(cnx)
+                continue
+
+            return cnx
+
+        return mysql.connector.connect(**self.config)
+
+    def release(self, cnx, discard=False, reset=False):
+        """Return cnx to the idle list, resetting any open transaction.
+
+        reset: cnx ran arbitrary SQL; COM_RESET_CONNECTION drops what it may
+        have left in the session (USE, SET SESSION, user variables,
+        temporary tables, locks, prepared statements) or cnx is closed.
+        """
+        try:
+            if discard or cnx.unread_result:
+                _close_quietly(cnx)
+                return
+
+            # A pooled connection must not carry a transaction (or its
+            # REPEATABLE READ snapshot) over to the next request.
+            if cnx.in_transaction:
+                cnx.rollback()
+
+            if reset:
+                # The server deallocates the connection's prepared statements.
+                with _STATEMENTS_LOCK:
+                    _STATEMENTS.pop(cnx, None)
+                if not cnx.cmd_reset_connection():
+                    _close_quietly(cnx)
+                    return
+
+            with self._lock:
+                self._free.append((cnx, time.monotonic()))
+
+        except Exception:
+            _close_quietly(cnx)
+
+        finally:
+            with self._lock:
+                self.checked_out -= 1
+            self._slots.release()
+
+    def evict(self, now=None):
+        """Close connections idle longer than the idle timeout."""
+        if now is None:
+            now = time.monotonic()
+
+        stale = []
+        with self._lock:
+            while self._free and now - self._free[0][1] > self.idle:
+                stale.append(self._free.popleft()[0])
+
+        for cnx in stale:
+            _close_quietly(cnx)
+
+    def clear(self):
+        """Close every idle connection."""
+        with self._lock:
+            stale = [cnx for cnx, _last in self._free]
+            self._free.clear()
+
+        for cnx in stale:
+            _close_quietly(cnx)
+
+    def stats(self):
+        """Return pool counters."""
+        with self._lock:
+            return {'idle': len(self._free), 'checkedOut': self.checked_out}
+
+
+_POOLS = {}
+_POOLS_LOCK = threading.Lock()
+_PID = os.getpid()
+_LAST_SWEEP = time.monotonic()
+
+
+def pool_key(config):
+    """Return a hashable key identifying config, without the cleartext password."""
+    items = []
+    for key in sorted(config):
+        value = config[key]
+        if key == 'password':
+            value = hashlib.sha256(str(value).encode('utf-8')).hexdigest()
+        items.append((key, value))
+    return tuple(items)
+
+
+def _reset_after_fork():
+    """Forget pools inherited from the parent process.
+
+    The sockets belong to the parent; closing them here would send
+    COM_QUIT on the parent's sessions, so they are simply dropped.
+    """
+    global _POOLS_LOCK, _PID  # pylint: disable=global-statement
+    _POOLS.clear()
+    _POOLS_LOCK = threading.Lock()
+    _PID = os.getpid()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_pool(config):
+    """Return the process-wide pool for config, creating it on first use."""
+    global _LAST_SWEEP  # pylint: disable=global-statement
+
+    if os.getpid() != _PID:
+        _reset_after_fork()
+
+    key = pool_key(config)
+    now = time.monotonic()
+
+    with _POOLS_LOCK:
+        pool = _POOLS.get(key)
+        if pool is None:
+            pool = _POOLS[key] = ConnectionPool(dict(config))
+
+        sweep = now - _LAST_SWEEP > POOL_IDLE / 2
+        if sweep:
+            _LAST_SWEEP = now
+            pools = list(_POOLS.values())
+
+    if sweep:
+        for _pool in pools:
+            _pool.evict(now)
+
+    return pool
+
+
+def connect(config):
+    """Return a pooled connection for config (or a plain one if pooling is off)."""
+    if not POOL_ENABLED:
+        return mysql.connector.connect(**config)
+    return get_pool(config).acquire()
+
+
+_STATEMENTS = weakref.WeakKeyDictionary()
+_STATEMENTS_LOCK = threading.Lock()
+
+
+def execute_prepared(cnx, sql, params):
+    """Execute sql as a server-side prepared statement (binary protocol).
+
+    A pooled connection keeps its last STMT_CACHE statements prepared,
+    least recently used closed first, so repeating a SQL text skips the
+    server's parse; any other connection prepares and closes each time.
+
+    Returns:
+        Tuple of (rows, lastrowid)
+    """
+    raw = cnx.__dict__.get('_cnx') if isinstance(cnx, PooledConnection) else None
+    if raw is None or STMT_CACHE <= 0:
+        cur = cnx.cursor(prepared=True)
+        try:
+            cur.execute(sql, params)
+            return (cur.fetchall() if cur.with_rows else []), cur.lastrowid
+        finally:
+            cur.close()
+
+    with _STATEMENTS_LOCK:
+        statements = _STATEMENTS.get(raw)
+        if statements is None:
+            statements = _STATEMENTS[raw] = OrderedDict()
+
+    # Only this request's thread uses the connection's statements.
+    entry = statements.get(sql)
+    if entry is None:
+        # The cursor re-prepares unless handed the very same str object,
+        # so the first one seen is kept and reused.
+        entry = statements[sql] = (sql, raw.cursor(prepared=True))
+        while len(statements) > STMT_CACHE:
+            _close_quietly(statements.popitem(last=False)[1][1])
+    else:
+        statements.move_to_end(sql)
+
+    operation, cur = entry
+    try:
+        cur.execute(operation, params)
+        return (cur.fetchall() if cur.with_rows else []), cur.lastrowid
+    except Exception:
+        statements.pop(sql, None)
+        _close_quietly(cur)
+        raise
+
+
+def stats():
+    """Return counters summed over every pool in this process."""
+    with _POOLS_LOCK:
+        pools = list(_POOLS.values())
+
+    result = {'pools': len(pools), 'size': POOL_SIZE, 'idle': 0, 'checkedOut': 0}
+    for pool in pools:
+        counters = pool.stats()
+        result['idle'] += counters['idle']
+        result['checkedOut'] += counters['checkedOut']
+    return result
+
+
+def _close_quietly(cnx):
+    """Close cnx, ignoring errors from an already broken socket."""
+    try:
+        cnx.close()
+    except Exception:  # pylint: disable=broad-except
+        pass
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+
+"""query: ?fields= ?where= ?order= ?limit= compiled to placeholder SQL.
+
+    fields=id,name                 columns to select (default *)
+    where=dept.eq.IT               column.operator.value, repeat for AND
+    where=id.in.1,2,3              in / nin take a comma separated list
+    where=suspended.is.null        is: null, notnull, true, false
+    order=-synced_at,id            comma separated, - for descending
+    limit=10 or limit=20,10        [offset,]count
+
+Column names are checked against the table's columns and quoted;
+values only ever travel as parameters.
+"""
+
+import re
+
+
+class QueryError(ValueError):
+    """Malformed query parameter or unknown column."""
+
+
+OPERATORS = {'eq': '=', 'ne': '<>', 'gt': '>', 'gte': '>=', 'lt': '<', 'lte': '<=',
+             'like': 'LIKE', 'nlike': 'NOT LIKE', 'in': 'IN', 'nin': 'NOT IN', 'is': 'IS'}
+IS_VALUES = {'null': 'IS NULL', 'notnull': 'IS NOT NULL', 'true': 'IS TRUE', 'false': 'IS FALSE'}
+LIMIT_RE = re.compile(r'^\s*\d+\s*(,\s*\d+\s*)?$')
+
+
+class Select:
+    """Compiled pieces of a SELECT; clause strings are empty when not used."""
+
+    def __init__(self, fields, where, params, order, limit, filters=(), sort=()):
+        """Initialize select.
+
+        Args:
+            fields: Select list, e.g. '`id`,`name`' or '*'
+            where: Condition without the WHERE keyword, or ''
+            params: Parameters for the placeholders in where
+            order: ORDER BY clause with leading space, or ''
+            limit: LIMIT clause with leading space, or ''
+            filters: (column, operator) per where clause
+            sort: Columns of the ORDER BY, in order
+        """
+        self.fields = fields
+        self.where = where
+        self.params = params
+        self.order = order
+        self.limit = limit
+        self.filters = tuple(filters)
+        self.sort = tuple(sort)
+
+    def sql(self, source):
+        """Full SELECT statement reading from source (database.table)."""
+        sql = "SELECT " + self.fields + " FROM " + source
+        if self.where:
+            sql += " WHERE " + self.where
+        return sql + self.order + self.limit
+
+
+def quote(name):
+    """Backtick-quote an identifier."""
+    return '`' + name.replace('`', '``') + '`'
+
+
+def _column(name, columns):
+    """Canonical column name for name (case-insensitive), or QueryError."""
+    column = columns.get(name.strip().strip('`').lower())
+    if column is None:
+        raise QueryError("Unknown column: " + name)
+    return column
+
+
+def parse_fields(fields, columns):
+    """fields -> quoted select list."""
+    names = [name for name in (fields or '*').split(',') if name.strip()]
+    if not names or [name.strip() for name in names] == ['*']:
+        return '*'
+    return ','.join(quote(_column(name, columns)) for name in names)
+
+
+def parse_where(clauses, columns):
+    """where clauses -> (condition, params, filters), ANDed together."""
+    conditions = []
+    params = []
+    filters = []
+    for clause in clauses:
+        parts = clause.split('.', 2)
+        if len(parts) != 3 or parts[1].lower() not in OPERATORS:
+            raise QueryError("where must be column.operator.value with operator one of " +
+                             ", ".join(OPERATORS))
+        name, op, value = parts
+        op = op.lower()
+        filters.append((_column(name, columns), op))
+        column = quote(filters[-1][0])
+
+        if op == 'is':
+            if value.lower() not in IS_VALUES:
+                raise QueryError("is takes one of " + ", ".join(IS_VALUES))
+            conditions.append(column + " " + IS_VALUES[value.lower()])
+        elif op in ['in', 'nin']:
+            values = value.split(',')
+            conditions.append(column + " " + OPERATORS[op] + " (" + ",".join(['%s'] * len(values)) + ")")
+            params.extend(values)
+        else:
+            conditions.append(column + " " + OPERATORS[op] + " %s")
+            params.append(value)
+
+    return " AND ".join(conditions), params, filters
+
+
+def parse_order(order, columns):
+    """order -> (ORDER BY clause, sort columns)."""
+    if not order:
+        return '', []
+    terms = []
+    sort = []
+    for name in order.split(','):
+        name = name.strip()
+        direction = ' DESC' if name.startswith('-') else ''
+        sort.append(_column(name.lstrip('+-'), columns))
+        terms.append(quote(sort[-1]) + direction)
+    return " ORDER BY " + ",".join(terms), sort
+
+
+def parse_limit(limit):
+    """limit -> LIMIT clause."""
+    if not limit:
+        return ''
+    if not LIMIT_RE.match(limit):
+        raise QueryError("limit must be count or offset,count")
+    return " LIMIT " + limit.replace(' ', '')
+
+
+def compile_select(column_names, args):
+    """Compile request args (a MultiDict) against a table's column names.
+
+    Raises QueryError on bad syntax or an unknown column.
+    """
+    columns = {name.lower(): name for name in column_names}
+    where, params, filters = parse_where(args.getlist('where'), columns)
+    order, sort = parse_order(args.get('order'), columns)
+    return Select(parse_fields(args.get('fields'), columns),
+                  where, params, order,
+                  parse_limit(args.get('limit')),
+                  filters, sort)
@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+
+"""resultcache: read-result cache with per-table generation counters.
+
+Every cache key embeds the current generation of the tables a query
+reads (and of their database, and a global one); a write bumps the
+generation, so older entries are simply never looked up again and age
+out by TTL. With the shm backend entries and generations live in one
+SQLite file (in a private directory on /dev/shm by default) shared by
+every worker process of this user.
+"""
+
+import base64
+import hashlib
+import json
+import os
+import sqlite3
+import stat
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta
+from datetime import time as dt_time
+from decimal import Decimal
+
+from . import cache
+
+ALL = '*'
+
+# Tags for the values JSON has no type for; rows never hold objects, so a
+# one-key object is always a tag.
+_TAGS = {
+    '$decimal': Decimal,
+    '$datetime': datetime.fromisoformat,
+    '$date': date.fromisoformat,
+    '$time': dt_time.fromisoformat,
+    '$timedelta': lambda parts: timedelta(*parts),
+    '$bytes': base64.b64decode,
+    '$set': set,
+}
+
+
+def _tag(value):
+    """JSON stand-in for a value json can not encode (json.dumps default=)."""
+    if isinstance(value, Decimal):
+        return {'$decimal': str(value)}
+    if isinstance(value, datetime):
+        return {'$datetime': value.isoformat()}
+    if isinstance(value, date):
+        return {'$date': value.isoformat()}
+    if isinstance(value, dt_time):
+        return {'$time': value.isoformat()}
+    if isinstance(value, timedelta):
+        return {'$timedelta': [value.days, value.seconds, value.microseconds]}
+    if isinstance(value, (bytes, bytearray)):
+        return {'$bytes': base64.b64encode(value).decode('ascii')}
+    if isinstance(value, (set, frozenset)):
+        return {'$set': sorted(value)}
+    raise TypeError("Can not cache %s values" % type(value).__name__)
+
+
+def _untag(obj):
+    """Value for a tag written by _tag (json.loads object_hook)."""
+    if len(obj) == 1:
+        name, value = next(iter(obj.items()))
+        if name in _TAGS:
+            return _TAGS[name](value)
+    return obj
+
+
+def encode(value):
+    """Serialize column values (cached rows, cursor keys) to JSON; tuples become lists."""
+    return json.dumps(value, default=_tag, separators=(',', ':'))
+
+
+def decode(data):
+    """Inverse of encode()."""
+    return json.loads(data, object_hook=_untag)
+
+
+def _private_dir(directory):
+    """Create directory (0700) or check that only this user can use it."""
+    try:
+        os.mkdir(directory, 0o700)
+    except FileExistsError:
+        pass
+    info = os.lstat(directory)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077:
+        raise PermissionError("%s must be a directory private to uid %d" % (directory, os.getuid()))
+
+
+def _private_file(path):
+    """Create path (0600) or check that only this user can read or write it."""
+    try:
+        os.close(os.open(path, os.O_RDWR | os.O_CREAT | os.O_EXCL | getattr(os, 'O_NOFOLLOW', 0), 0o600))
+    except FileExistsError:
+        pass
+    info = os.lstat(path)
+    if not stat.S_ISREG(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077:
+        raise PermissionError("%s must be a file private to uid %d" % (path, os.getuid()))
+
+
+class MemoryBackend:
+    """Entries and generations in this process only."""
+
+    name = 'memory'
+
+    def __init__(self, maxsize=10000):
+        """Initialize backend.
+
+        Args:
+            maxsize: Entries kept (least recently used dropped first)
+        """
+        self._entries = cache.TTLCache(maxsize=maxsize)
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the live value for key, or None."""
+        return self._entries.get(key)
+
+    def set(self, key, value, ttl):
+        """Store value under key for ttl seconds."""
+        self._entries.set(key, value, ttl)
+
+    def generations(self, names):
+        """Return the generation of each name."""
+        with self._lock:
+            return [self._generations.get(name, 0) for name in names]
+
+    def bump(self, name):
+        """Advance the generation of name."""
+        with self._lock:
+            self._generations[name] = self._generations.get(name, 0) + 1
+
+    def size(self):
+        """Return the number of stored entries."""
+        return self._entries.stats()['size']
+
+
+class SqliteBackend:
+    """Entries and generations in a SQLite file shared between processes."""
+
+    name = 'shm'
+
+    def __init__(self, path=None, maxsize=10000):
+        """Initialize backend.
+
+        Args:
+            path: Database file; default results.sqlite in db-api-<uid>/ on
+                /dev/shm (or the temp dir), a directory only this user may use
+            maxsize: Entries kept before the soonest to expire are pruned
+        """
+        self.directory = None
+        if path is None:
+            base = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+            self.directory = os.path.join(base, 'db-api-%d' % os.getuid())
+            path = os.path.join(self.directory, 'results.sqlite')
+        self.path = path
+        self.maxsize = maxsize
+        self._local = threading.local()
+        self._writes = 0
+
+    def _db(self):
+        """Return this thread's connection (new after a fork)."""
+        db = getattr(self._local, 'db', None)
+        if db is None or self._local.pid != os.getpid():
+            # Other users must neither read the results nor plant entries.
+            if self.directory is not None:
+                _private_dir(self.directory)
+            _private_file(self.path)
+            db = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=OFF")
+            db.execute("CREATE TABLE IF NOT EXISTS results "
+                       "(key TEXT PRIMARY KEY, value TEXT, expires REAL)")
+            db.execute("CREATE TABLE IF NOT EXISTS generations "
+                       "(name TEXT PRIMARY KEY, gen INTEGER NOT NULL)")
+            self._local.db = db
+            self._local.pid = os.getpid()
+        return db
+
+    def get(self, key):
+        """Return the live value for key, or None."""
+        row = self._db().execute("SELECT value, expires FROM results WHERE key=?", (key,)).fetchone()
+        if row is None or row[1] < time.time():
+            return None
+        return decode(row[0])
+
+    def set(self, key, value, ttl):
+        """Store value under key for ttl seconds, pruning now and then."""
+        db = self._db()
+        now = time.time()
+        db.execute("INSERT OR REPLACE INTO results (key, value, expires) VALUES (?, ?, ?)",
+                   (key, encode(value), now + ttl))
+        self._writes += 1
+        if self._writes % 256 == 0:
+            db.execute("DELETE FROM results WHERE expires < ?", (now,))
+            excess = db.execute("SELECT COUNT(*) FROM results").fetchone()[0] - self.maxsize
+            if excess > 0:
+                db.execute("DELETE FROM results WHERE key IN "
+                           "(SELECT key FROM results ORDER BY expires LIMIT ?)", (excess,))
+
+    def generations(self, names):
+        """Return the generation of each name."""
+        rows = self._db().execute("SELECT name, gen FROM generations WHERE name IN (%s)" %
+                                  ",".join('?' * len(names)), names).fetchall()
+        found = dict(rows)
+        return [found.get(name, 0) for name in names]
+
+    def bump(self, name):
+        """Advance the generation of name (visible to every process)."""
+        db = self._db()
+        db.execute("INSERT OR IGNORE INTO generations (name, gen) VALUES (?, 0)", (name,))
+        db.execute("UPDATE generations SET gen = gen + 1 WHERE name=?", (name,))
+
+    def size(self):
+        """Return the number of stored entries."""
+        return self._db().execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+
+class ResultCache:
+    """Cache of query results keyed by credentials, SQL, params and table generations."""
+
+    def __init__(self, backend, ttl=30.0):
+        """Initialize cache.
+
+        Args:
+            backend: MemoryBackend or SqliteBackend
+            ttl: Seconds an entry is served at most (safety net for outside writes)
+        """
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    @staticmethod
+    def _names(database, tables):
+        """Generation names a query on database.tables depends on."""
+        return [ALL, database + '.' + ALL] + [database + '.' + table for table in tables]
+
+    def lookup(self, identity, database, tables, sql, params):
+        """Return (key, cached value or None) for a query on database.tables."""
+        try:
+            names = self._names(database, tables)
+            generations = self.backend.generations(names)
+            key = hashlib.sha256(repr((identity, sql, tuple(params or ()), names, generations))
+                                 .encode('utf-8')).hexdigest()
+            value = self.backend.get(key)
+        except Exception as e:  # pylint: disable=broad-except
+            print(f"Result cache lookup failed: {e}")
+            self.errors += 1
+            return None, None
+
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return key, value
+
+    def store(self, key, value):
+        """Store value under a key returned by lookup()."""
+        if key is None:
+            return
+        try:
+            self.backend.set(key, value, self.ttl)
+        except Exception as e:  # pylint: disable=broad-except
+            print(f"Result cache store failed: {e}")
+            self.errors += 1
+
+    def invalidate(self, database=None, table=None):
+        """Retire entries reading database.table (the whole database, or everything)."""
+        if database is None:
+            name = ALL
+        else:
+            name = database + '.' + (table or ALL)
+        try:
+            self.backend.bump(name)
+        except Exception as e:  # pylint: disable=broad-except
+            print(f"Result cache invalidation failed: {e}")
+            self.errors += 1
+
+    def stats(self):
+        """Return backend, size and hit/miss counters."""
+        try:
+            size = self.backend.size()
+        except Exception:  # pylint: disable=broad-except
+            size = None
+        return {'backend': self.backend.name,
+                'size': size,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'errors': self.errors}
+
+
+def from_env():
+    """ResultCache configured by DB_API_RESULT_CACHE (memory|shm), or None when off."""
+    kind = os.environ.get('DB_API_RESULT_CACHE', '').lower()
+    if kind in ['', '0', 'false', 'no', 'off']:
+        return None
+
+    maxsize = int(os.environ.get('DB_API_RESULT_CACHE_SIZE', '10000'))
+    if kind == 'shm':
+        backend = SqliteBackend(os.environ.get('DB_API_RESULT_CACHE_PATH'), maxsize=maxsize)
+    else:
+        backend = MemoryBackend(maxsize=maxsize)
+    return ResultCache(backend, ttl=float(os.environ.get('DB_API_RESULT_CACHE_TTL', '30')))
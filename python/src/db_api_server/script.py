@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+
+"""script: text/sql scripts run statement by statement."""
+
+try:
+    from mysql.connector._scripting import split_multi_statement
+except ImportError:
+    # mysql-connector before 9.2
+    split_multi_statement = None
+
+# Statements go to the server one at a time, so each can commit on its own.
+SPLITS = split_multi_statement is not None
+
+
+class Failed(Exception):
+    """Statement index of a script failed with error."""
+
+    def __init__(self, index, error):
+        super().__init__(str(error))
+        self.index = index
+        self.error = error
+
+
+def statements(sql):
+    """The single statements of script sql (DELIMITER aware)."""
+    single = []
+    for partition in split_multi_statement(sql.encode('utf-8'), map_results=True):
+        single.extend(stmt.decode('utf-8') for stmt in partition['single_stmts'] if stmt.strip())
+    return single
+
+
+def results(cnx, cur, sql, transaction=False):
+    """Yield (statement index, cursor positioned on one of its results).
+
+    With SPLITS every statement is a query of its own: all its results
+    (several for a CALL) are read before the next one is sent, and
+    outside a transaction it is committed in between. Older connectors
+    send the script as one multi-statement query (execute(multi=True));
+    nothing may be sent while its results are pending, so the caller
+    commits once at the end. Raises Failed with the failing statement.
+    """
+    index = 0
+    try:
+        if not SPLITS:
+            for result in cur.execute(sql, multi=True):
+                yield index, result
+                index += 1
+            return
+
+        for index, statement in enumerate(statements(sql)):
+            cur.execute(statement)
+            yield index, cur
+            while cur.nextset():
+                yield index, cur
+            if not transaction:
+                cnx.commit()
+    except Exception as e:
+        raise Failed(index, e) from e
+
+
+def timeout_sql(server_info, seconds):
+    """SET statement bounding each statement to seconds, or None.
+
+    MySQL's max_execution_time (milliseconds) only applies to SELECT;
+    MariaDB's max_statement_time (seconds) applies to every statement.
+    The session is reset when the connection goes back to the pool.
+    """
+    if not seconds or seconds <= 0:
+        return None
+    if 'mariadb' in (server_info or '').lower():
+        return "SET SESSION max_statement_time=%.3f" % seconds
+    return "SET SESSION max_execution_time=%d" % max(int(seconds * 1000), 1)
+
+
+def frames(cnx, results_iter, batch, transaction=False):
+    """Yield one NDJSON-ready dict per event of a running script.
+
+    {"statement": i, "columns": [...]} then {"statement": i, "rows": [...]}
+    per batch for a result set, {"statement": i, "rowcount", "lastrowid"}
+    when a result ends, {"done": true, "statements": n} at the end, or
+    {"error", "statement": i, "rolledBack"} when statement i fails.
+    rolledBack is true when nothing of the script was kept.
+    """
+    position = count = 0
+    try:
+        for index, result in results_iter:
+            position = index
+            count = index + 1
+            if result.with_rows:
+                yield {'statement': index, 'columns': list(result.column_names)}
+                rows = result.fetchmany(batch)
+                while rows:
+                    yield {'statement': index, 'rows': rows}
+                    rows = result.fetchmany(batch)
+            yield {'statement': index, 'rowcount': result.rowcount, 'lastrowid': result.lastrowid or None}
+        cnx.commit()
+        yield {'done': True, 'statements': count}
+    except Exception as e:  # pylint: disable=broad-except
+        if isinstance(e, Failed):
+            position, e = e.index, e.error
+        try:
+            cnx.rollback()
+        except Exception:  # pylint: disable=broad-except
+            # Results still pending; the connection is discarded on release.
+            pass
+        yield {'error': str(e), 'statement': position, 'rolledBack': transaction or not SPLITS}
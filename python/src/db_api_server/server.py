@@ -7,21 +7,43 @@ from __future__ import absolute_import
 
 __version__ = '1.0.6'
 
+import atexit
 import base64
-import decimal
+import hashlib
 import json
-from datetime import datetime
+import os
+import queue
+import re
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timezone
 
-import flask.json
 from flask import Flask
 from flask import request
 from flask import jsonify
 from flask import send_file
+from flask import Response
+from flask import copy_current_request_context
 from werkzeug.exceptions import HTTPException
 from flask_cors import CORS
+import mysql.connector
 from io import BytesIO
 
-import mysql.connector
+from . import advisor
+from . import cache
+from . import compress
+from . import export
+from . import fastjson
+from . import jobs
+from . import pool
+from . import query
+from . import resultcache
+from . import script
+from . import thumbnails
+from . import txbatch
+from . import upsert
+from . import writebehind
+from .fastjson import AppJSONEncoder
 
 try:
     from .google_directory import create_client_from_env
@@ -31,44 +53,70 @@ except ImportError:
     create_client_from_env = None
 
 
-class AppJSONEncoder(json.JSONEncoder):
-    """app: json encoder."""
-
-    def default(self, o):
-        """default: self."""
-        if isinstance(o, decimal.Decimal):
-            # Convert decimal instance to string
-            return str(o)
-
-        if isinstance(o, bytes):
-            # Convert bytes instance to string, json
-            try:
-                o = o.decode('utf-8')
-                try:
-                    o = json.loads(o)
-                    return o
-                except json.decoder.JSONDecodeError:
-                    return str(o)
-
-            except UnicodeDecodeError:
-                return str(o)
-
-        if isinstance(o, bytearray):
-            # Convert bytearray instance to string
-            o = o.decode('utf-8')
-            return str(o)
-
-        return super().default(o)
-
-
 APP = Flask(__name__)
 CORS(APP, support_credentials=True)
 
-APP.json_encoder = AppJSONEncoder
-APP.config['JSONIFY_PRETTYPRINT_REGULAR'] = True     # default False
+if fastjson.JSONProvider is object:
+    APP.json_encoder = AppJSONEncoder                # Flask < 2.2
+else:
+    APP.json = fastjson.AppJSONProvider(APP)         # compact, ?pretty=1 to indent
+APP.config['JSONIFY_PRETTYPRINT_REGULAR'] = fastjson.PRETTY  # default False
 APP.config['JSON_SORT_KEYS'] = False                 # default True
 APP.config['JSONIFY_MIMETYPE'] = 'application/json'  # default 'application/json'
 
+# Filtered reads are recorded for the /_advisor index report.
+ADVISOR_ENABLED = os.environ.get('DB_API_ADVISOR', '1').lower() not in ['0', 'false', 'no']
+ADVISOR = advisor.Advisor(max_shapes=int(os.environ.get('DB_API_ADVISOR_SHAPES', '1000')))
+# Hot fixed-shape lookups run as server-side prepared statements.
+PREPARED = os.environ.get('DB_API_PREPARED', '').lower() in ['1', 'true', 'yes']
+# Rows past which ?query=true listings are streamed instead of buffered.
+STREAM_ROWS = int(os.environ.get('DB_API_STREAM_ROWS', '10000'))
+# Rows read from the server per fetchmany() while streaming.
+STREAM_BATCH = int(os.environ.get('DB_API_STREAM_BATCH', '1000'))
+# Default per-statement timeout (seconds, 0 = none) for text/sql scripts; ?timeout= overrides.
+SQL_TIMEOUT = float(os.environ.get('DB_API_SQL_TIMEOUT', '0'))
+# Default and maximum page_size for keyset (?after=) pagination.
+PAGE_SIZE = int(os.environ.get('DB_API_PAGE_SIZE', '100'))
+PAGE_MAX = int(os.environ.get('DB_API_PAGE_MAX', '1000'))
+# Rows per multi-VALUES INSERT for bulk POST (override with ?batch=).
+INSERT_BATCH = int(os.environ.get('DB_API_INSERT_BATCH', '500'))
+# Operations accepted by one POST /api/<database>/_batch.
+BATCH_MAX = int(os.environ.get('DB_API_BATCH_MAX', '1000'))
+
+# SHOW DATABASES / TABLES / FIELDS / KEYS results, per connection target.
+SCHEMA_CACHE = cache.TTLCache(maxsize=int(os.environ.get('DB_API_SCHEMA_CACHE_SIZE', '1024')),
+                              ttl=float(os.environ.get('DB_API_SCHEMA_CACHE_TTL', '60')))
+# user_rfid lookup tables for the door-reader hot path.
+RFID_INDEX = cache.LookupIndex(ttl=float(os.environ.get('DB_API_RFID_TTL', '60')),
+                               negative_ttl=float(os.environ.get('DB_API_RFID_NEGATIVE_TTL', '5')))
+# google_users external_id -> (id, primary_email), reloaded after every user sync.
+GOOGLE_USER_INDEX = cache.LookupIndex(ttl=float(os.environ.get('DB_API_GOOGLE_USER_TTL', '300')),
+                                      negative_ttl=float(os.environ.get('DB_API_GOOGLE_USER_NEGATIVE_TTL', '5')))
+# Opt-in write-behind queue for /attendance/log.
+ATTENDANCE_WRITE_BEHIND = os.environ.get('DB_API_ATTENDANCE_WRITE_BEHIND', '').lower() in ['1', 'true', 'yes']
+ATTENDANCE_ACK = os.environ.get('DB_API_ATTENDANCE_ACK', 'queued')
+ATTENDANCE_PUT_TIMEOUT = float(os.environ.get('DB_API_ATTENDANCE_PUT_TIMEOUT', '0.5'))
+ATTENDANCE_ACK_TIMEOUT = float(os.environ.get('DB_API_ATTENDANCE_ACK_TIMEOUT', '10'))
+# Lock wait timeout, deadlock, can't connect, server gone away, lost connection.
+TRANSIENT_ERRNOS = {1205, 1213, 2003, 2006, 2013}
+# Google photo sync: concurrent Directory API calls, photos per REPLACE.
+GOOGLE_SYNC_WORKERS = int(os.environ.get('GOOGLE_SYNC_WORKERS', '8'))
+PHOTO_SYNC_BATCH = int(os.environ.get('DB_API_PHOTO_SYNC_BATCH', '50'))
+USER_SYNC_BATCH = int(os.environ.get('DB_API_USER_SYNC_BATCH', '500'))
+# Background reloads of expired lookup tables.
+REFRESHER = ThreadPoolExecutor(max_workers=2, thread_name_prefix='refresh')
+# Background runner for the Google sync endpoints.
+SYNC_JOBS = jobs.JobRunner(max_workers=int(os.environ.get('DB_API_JOB_WORKERS', '2')))
+# Cache-Control sent with stored Google user photos (validated by ETag).
+PHOTO_CACHE_CONTROL = os.environ.get('DB_API_PHOTO_CACHE_CONTROL', 'private, no-cache')
+# Decoded photo bytes, keyed per credential/database/userKey/variant
+PHOTO_CACHE = cache.BlobCache(max_bytes=int(os.environ.get('DB_API_PHOTO_CACHE_BYTES', str(64 * 1024 * 1024))),
+                              ttl=float(os.environ.get('DB_API_PHOTO_CACHE_TTL', '300')))
+# Read results keyed by credentials/SQL/params, retired by writes to their
+# tables (DB_API_RESULT_CACHE=memory|shm, off by default; see resultcache.py)
+RESULT_CACHE = resultcache.from_env()
+DDL_RE = re.compile(r'\b(CREATE|ALTER|DROP|RENAME|TRUNCATE)\b', re.IGNORECASE)
+
 
 @APP.route("/", methods=['GET'])
 def root():
@@ -76,11 +124,23 @@ def root():
     return jsonify(status=200, message="OK", version=__version__), 200
 
 
+@APP.route("/stats", methods=['GET'])
+def show_stats():
+    """GET: Show connection pool and cache counters."""
+    return jsonify(pool=pool.stats(),
+                   schemaCache=SCHEMA_CACHE.stats(),
+                   rfidIndex=RFID_INDEX.stats(),
+                   googleUserIndex=GOOGLE_USER_INDEX.stats(),
+                   photoCache=PHOTO_CACHE.stats(),
+                   resultCache=RESULT_CACHE.stats() if RESULT_CACHE else None,
+                   attendanceQueue=ATTENDANCE_QUEUE.stats()), 200
+
+
 @APP.route("/api", methods=['GET'])
 def show_databases():
     """GET: /api Show Databases."""
     sql = "SHOW DATABASES"
-    rows = fetchall(sql)
+    rows = fetchall_schema(sql)
     return jsonify(rows), 200
 
 
@@ -89,7 +149,7 @@ def show_tables(database=None):
     """GET: /api/<database> Show Database Tables."""
     database = request.view_args['database']
     sql = "SHOW TABLES FROM " + database
-    rows = fetchall(sql)
+    rows = fetchall_schema(sql)
     return jsonify(rows), 200
 
 
@@ -97,21 +157,77 @@ def show_tables(database=None):
 def get_many(database=None, table=None):
     """GET: /api/<database>/<table> Show Database Table fields."""
     # ?query=true List rows of table. fields=id,name&limit=2,5
+    # &where=dept.eq.IT&order=-synced_at Filter and sort (see query.py).
+    # &stream=1 (or stream=ndjson) Stream rows instead of buffering them.
+    # &format=csv|ndjson|arrow|parquet (or Accept) Stream an export.
     database = request.view_args['database']
     table = request.view_args['table']
 
-    fields = request.args.get("fields", '*')
     limit = request.args.get("limit", None)
 
     if not request.query_string:
-        sql = "SHOW FIELDS FROM " + database + "." + table
-    else:
-        sql = "SELECT " + fields + " FROM " + database + "." + table
+        rows = table_fields(database, table)
+        if rows:
+            return jsonify(rows), 200
+        return jsonify(status=404, message="Not Found"), 404
 
-    if limit:
-        sql += " LIMIT " + limit
-
-    rows = fetchall(sql)
+    try:
+        select = query.compile_select([row[0] for row in table_fields(database, table)], request.args)
+        page = page_args()
+    except ValueError as e:
+        return jsonify(status=400, message=str(e)), 400
+
+    if page:
+        if limit or select.order:
+            return jsonify(status=400, message="limit/order can not be combined with after/page_size"), 400
+        return get_page(database, table, select, *page)
+
+    sql = select.sql(database + "." + table)
+    params = tuple(select.params)
+
+    fmt = export.negotiate(request.args.get("format"), request.headers.get('Accept', ''))
+    if request.args.get("format") and not fmt:
+        return jsonify(status=400, message="format must be one of " + ", ".join(export.MIMETYPES)), 400
+
+    if fmt in export.NEEDS_PYARROW:
+        if export.pyarrow is None:
+            return jsonify(status=406, message=fmt + " export not available (pyarrow not installed)"), 406
+        started = time.monotonic()
+        description, batches = fetchiter_described(sql, params)
+        advise(database, table, select.filters, select.sort, sql, params, started)
+        return Response(export.arrow_stream(description, batches, fmt), status=200,
+                        mimetype=export.MIMETYPES[fmt])
+
+    if fmt == 'csv':
+        started = time.monotonic()
+        description, batches = fetchiter_described(sql, params)
+        advise(database, table, select.filters, select.sort, sql, params, started)
+        return Response(export.csv_stream(description, batches), status=200,
+                        mimetype=export.MIMETYPES[fmt])
+
+    stream = request.args.get("stream", '').lower()
+    ndjson = stream == 'ndjson' or fmt == 'ndjson'
+    want_stream = ndjson or stream in ['1', 'true', 'yes']
+
+    rows = cache_key = None
+    if RESULT_CACHE and not want_stream:
+        cache_key, rows = RESULT_CACHE.lookup(sql_identity(), database, [table], sql, params)
+
+    if rows is None:
+        started = time.monotonic()
+        batches = fetchiter(sql, params)
+
+        # Read up to the threshold; small results keep the buffered response.
+        rows = []
+        for batch in batches:
+            rows.extend(batch)
+            if want_stream or len(rows) >= STREAM_ROWS:
+                advise(database, table, select.filters, select.sort, sql, params, started)
+                return stream_rows(rows, batches, ndjson)
+        advise(database, table, select.filters, select.sort, sql, params, started)
+
+        if cache_key is not None:
+            RESULT_CACHE.store(cache_key, rows)
 
     if rows:
         return jsonify(rows), 200
@@ -119,6 +235,40 @@ def get_many(database=None, table=None):
     return jsonify(status=404, message="Not Found"), 404
 
 
+def get_page(database, table, select, after, page_size):
+    """GET: one keyset page of /api/<database>/<table>?after=&page_size=.
+
+    select is the compiled fields/where (query.Select).
+    """
+    # Pages are ordered by primary key; the key columns are appended to
+    # the select list so the next cursor can be built, then stripped.
+    keys = primary_key(database, table)
+    if not keys:
+        return jsonify(status=400, message="Table has no primary key"), 400
+
+    try:
+        sql, params = keyset_sql("SELECT " + select.fields + ", " +
+                                 ",".join(query.quote(key) for key in keys) +
+                                 " FROM " + database + "." + table,
+                                 keys, after, page_size, select.where, select.params)
+    except ValueError as e:
+        return jsonify(status=400, message=str(e)), 400
+
+    def read():
+        started = time.monotonic()
+        rows = fetchall_params(sql, params)
+        advise(database, table, select.filters, keys, sql, params, started)
+        return rows
+
+    rows = cached_read(database, [table], sql, params, read)
+
+    more = len(rows) > page_size
+    rows = rows[:page_size]
+    next_cursor = encode_cursor(rows[-1][-len(keys):]) if more else None
+
+    return jsonify(rows=[row[:-len(keys)] for row in rows], next=next_cursor), 200
+
+
 @APP.route("/api/<database>/<table>/<key>", methods=['GET'])
 def get_one(database=None, table=None, key=None):
     """GET: /api/<database>/<table>:id."""
@@ -130,16 +280,104 @@ def get_one(database=None, table=None, key=None):
     fields = request.args.get("fields", '*')
     column = request.args.get("column", 'id')
 
+    unknown = unknown_columns(database, table, fields + "," + column)
+    if unknown:
+        return jsonify(status=400, message="Unknown column: " + ",".join(unknown)), 400
+
     sql = "SELECT " + fields + " FROM " + database + "." + table
-    sql += " WHERE " + column + "='" + key + "'"
+    sql += " WHERE " + column + "=%s"
+
+    def read():
+        started = time.monotonic()
+        row = fetchone_params(sql, (key,))
+        advise(database, table, [(column, 'eq')], [], sql, (key,), started)
+        return row
 
-    row = fetchone(sql)
+    row = cached_read(database, [table], sql, (key,), read)
 
     if row:
         return jsonify(row), 200
 
     return jsonify(status=404, message="Not Found"), 404
 
+
+@APP.route("/api/<database>/_advisor", methods=['GET'])
+def get_advisor(database=None):
+    """GET: /api/<database>/_advisor -> observed query shapes and index advice.
+
+    Filtered reads (get_one ?column=, get_many ?where=/order=) are
+    recorded per table by shape: filtered columns and operators plus
+    sort columns, never values. Each shape is checked against SHOW
+    INDEX; candidates without a usable index get a suggested index and
+    the EXPLAIN of a recorded sample.
+
+    Query Parameters:
+    - top=N       Shapes reported, most total time first (default 20)
+    - explain=0   Skip EXPLAIN
+
+    Response:
+    - 200: [{"table", "filters", "sort", "count", "totalMs", "avgMs", "maxMs",
+             "sql", "indexes", "missingIndex", "suggestion", "explain"}, ...]
+    """
+    database = request.view_args['database']
+    try:
+        top = int(request.args.get('top', '20'))
+    except ValueError:
+        return jsonify(status=400, message="top must be an integer"), 400
+    want_explain = request.args.get('explain', '1').lower() not in ['0', 'false', 'no']
+    check_credentials()
+
+    indexes = {}
+    result = []
+    for shape in ADVISOR.shapes(database)[:top]:
+        table = shape['table']
+        if table not in indexes:
+            indexes[table] = advisor.index_columns(fetchall("SHOW INDEX FROM " + database + "." + table))
+
+        sql, params = shape['sample']
+        columns = advisor.missing_index(shape['filters'], shape['sort'], indexes[table])
+        entry = {'table': table,
+                 'filters': [column + " " + op for column, op in shape['filters']],
+                 'sort': shape['sort'],
+                 'count': shape['count'],
+                 'totalMs': round(shape['total'] * 1000, 3),
+                 'avgMs': round(shape['total'] * 1000 / shape['count'], 3),
+                 'maxMs': round(shape['max'] * 1000, 3),
+                 'sql': sql,
+                 'indexes': indexes[table],
+                 'missingIndex': columns is not None,
+                 'suggestion': None,
+                 'explain': None}
+
+        if columns:
+            entry['suggestion'] = ("CREATE INDEX idx_" + "_".join(columns) + " ON " + database + "." + table +
+                                   " (" + ",".join(query.quote(column) for column in columns) + ")")
+            if want_explain:
+                try:
+                    entry['explain'] = fetchall_dicts("EXPLAIN " + sql, params)
+                except Exception as e:  # pylint: disable=broad-except
+                    entry['explain'] = {'error': str(e)}
+
+        result.append(entry)
+
+    return jsonify(result), 200
+
+
+@APP.route("/api/<database>/_advisor", methods=['DELETE'])
+def reset_advisor(database=None):
+    """DELETE: /api/<database>/_advisor -> forget recorded query shapes."""
+    database = request.view_args['database']
+    check_credentials()
+    ADVISOR.reset(database)
+    return jsonify(status=200, message="OK"), 200
+
+
+def advise(database, table, filters, sort, sql, params, started):
+    """advisor: record a filtered read that began at started (time.monotonic())."""
+    if ADVISOR_ENABLED and (filters or sort):
+        ADVISOR.record(database, table, filters, sort, sql, params, time.monotonic() - started)
+
+
 @APP.route("/api/<database>/rfid/users", methods=['GET'])
 def get_rfid_users(database=None):
     """GET: /api/<database>/rfid/users -> list of user_id, rfid_uid, and type.
@@ -155,6 +393,7 @@ def get_rfid_users(database=None):
     sql = "SELECT user_id, rfid_uid, type FROM " + database + ".user_rfid"
 
     rows = fetchall(sql)
+    RFID_INDEX.load((sql_identity(), database), rfid_table_from_rows(rows))
 
     if rows:
         result = [{"user_id": row[0], "rfid_uid": row[1], "type": row[2]} for row in rows]
@@ -176,9 +415,15 @@ def get_user_by_rfid(database=None, rfidUID=None):
     database = request.view_args['database']
     rfidUID = request.view_args['rfidUID']
 
-    sql = "SELECT user_id, rfid_uid, type FROM " + database + ".user_rfid WHERE rfid_uid=%s LIMIT 1"
+    key, table = rfid_table(database)
+    row = RFID_INDEX.lookup(table, rfidUID)
 
-    row = fetchone_params(sql, (rfidUID,))
+    # Not in the bulk load: the badge may have been added since, unless
+    # it was looked up and found missing a moment ago.
+    if row is None and not RFID_INDEX.is_negative(key, rfidUID):
+        sql = "SELECT user_id, rfid_uid, type FROM " + database + ".user_rfid WHERE rfid_uid=%s LIMIT 1"
+        row = fetchone_prepared(sql, (rfidUID,))
+        RFID_INDEX.add(key, rfidUID, row)
 
     if row:
         return jsonify({"user_id": row[0], "rfid_uid": row[1], "type": row[2]}), 200
@@ -186,50 +431,95 @@ def get_user_by_rfid(database=None, rfidUID=None):
     return jsonify(status=404, message="Not Found"), 404
 
 
+def index_table(index, key, load, wait=True):
+    """cache: the table for key in LookupIndex index, load(cnx) reading and installing it.
+
+    An expired table keeps being served while one background thread
+    reloads it. A missing or invalidated table is loaded inline, once,
+    with concurrent requests waiting for that load - or, unless wait,
+    only started in the background and None returned.
+    """
+    table = index.table(key)
+    if table is not None:
+        return table
+
+    lock = index.refresh_lock(key)
+    table = index.stale(key)
+    if table is not None or not wait:
+        if lock.acquire(blocking=False):
+            try:
+                REFRESHER.submit(refresh_index_table, load, sql_config(), lock)
+            except Exception:
+                lock.release()
+                raise
+        return table
+
+    with lock:
+        table = index.table(key)
+        if table is None:
+            table = load(pool.connect(sql_config()))
+    return table
+
+
+def refresh_index_table(load, config, lock):
+    """cache: background load(cnx) of a lookup table; releases lock when done."""
+    try:
+        load(pool.connect(config))
+    except Exception as e:  # pylint: disable=broad-except
+        print(f"Error refreshing lookup table: {e}")
+    finally:
+        lock.release()
+
+
+def rfid_table(database):
+    """rfid: (index key, rfid_uid -> row table) for database, loading it in bulk if needed."""
+    key = (sql_identity(), database)
+    return key, index_table(RFID_INDEX, key, lambda cnx: load_rfid_table(cnx, key, database))
+
+
+def load_rfid_table(cnx, key, database):
+    """rfid: read user_rfid in one query on cnx (closed after) and install it."""
+    stamp = RFID_INDEX.stamp()
+    cur = cnx.cursor(buffered=True)
+    try:
+        cur.execute("SELECT user_id, rfid_uid, type FROM " + database + ".user_rfid")
+        table = rfid_table_from_rows(cur.fetchall())
+    finally:
+        cur.close()
+        cnx.close()
+    RFID_INDEX.load(key, table, stamp)
+    return table
+
+
+def rfid_table_from_rows(rows):
+    """rfid: rfid_uid -> (user_id, rfid_uid, type), first row per uid wins."""
+    table = {}
+    for row in rows:
+        table.setdefault(row[1], row)
+    return table
+
+
 @APP.route("/api/<database>/google/sync", methods=['POST'])
 def sync_google_users(database=None):
     """POST: /api/<database>/google/sync.
     
     Sync all Google Workspace users to database.
     
+    Only users whose content hash differs from the stored one are
+    written; users no longer in the directory are deleted. The sync runs
+    as a background job unless ?wait=true is given.
+
     Response:
-    - 201: {"status": 201, "message": "Sync completed", "users_synced": int}
+    - 201: {"status": 201, "message": "Sync completed", "users_synced": int,
+            "users_inserted": int, "users_updated": int, "users_deleted": int,
+            "users_unchanged": int}  (wait=true)
+    - 202: {"status": 202, "message": "Sync started", "id": int}
+    - 409: {"status": 409, "message": "A photo sync is already running", "id": int}
     - 503: {"status": 503, "message": "Google API not available"}
     - 500: {"status": 500, "message": error message}
     """
     database = request.view_args['database']
-    
-    if not GOOGLE_AVAILABLE:
-        return jsonify(status=503, message="Google API not configured"), 503
-    
-    try:
-        google_client = create_client_from_env()
-        if not google_client:
-            return jsonify(status=503, 
-                         message="Google credentials not configured"), 503
-        
-        # Log sync start
-        log_id = log_sync_start(database, 'full')
-        
-        # Fetch all users from Google
-        users = google_client.list_all_users()
-        
-        # Sync users to database
-        users_synced = 0
-        for user in users:
-            if sync_user_to_db(database, user):
-                users_synced += 1
-        
-        # Log sync completion
-        log_sync_complete(database, log_id, users_synced, 0)
-        
-        return jsonify(status=201,
-                      message="Sync completed",
-                      users_synced=users_synced), 201
-                      
-    except Exception as e:
-        log_sync_failed(database, log_id, str(e))
-        return jsonify(status=500, message=str(e)), 500
+    return start_sync(database, 'full', sync_users_job, "Sync completed")
 
 
 @APP.route("/api/<database>/google/sync/photos", methods=['POST'])
@@ -237,52 +527,258 @@ def sync_google_photos(database=None):
     """POST: /api/<database>/google/sync/photos.
     
     Sync all Google Workspace user photos to database.
+    Runs as a background job unless ?wait=true is given. Photos that
+    could not be stored are counted in photos_failed.
     
     Response:
-    - 201: {"status": 201, "message": "Photo sync completed", "photos_synced": int}
+    - 201: {"status": 201, "message": "Photo sync completed", "photos_synced": int,
+            "photos_failed": int}  (wait=true)
+    - 202: {"status": 202, "message": "Sync started", "id": int}
+    - 409: {"status": 409, "message": "A full sync is already running", "id": int}
     - 503: {"status": 503, "message": "Google API not available"}
     - 500: {"status": 500, "message": error message}
     """
     database = request.view_args['database']
+    return start_sync(database, 'photo', sync_photos_job, "Photo sync completed")
+
+
+@APP.route("/api/<database>/google/sync/<int:log_id>", methods=['GET'])
+def get_sync_status(database=None, log_id=None):
+    """GET: /api/<database>/google/sync/<id>.
+    
+    Status of a sync operation: live progress while this process runs
+    it, otherwise the google_sync_log entry.
+    
+    Response:
+    - 200: {"id": int, "syncType": str, "status": str, "progress": {...}, ...}
+    - 404: {"status": 404, "message": "Not Found"}
+    """
+    database = request.view_args['database']
+    log_id = request.view_args['log_id']
+
+    # Read the log entry first: it checks the credentials before a live job is shown.
+    sql = (
+        "SELECT id, sync_type, sync_status, users_synced, photos_synced, "
+        "error_message, started_at, completed_at "
+        "FROM " + database + ".google_sync_log WHERE id=%s LIMIT 1"
+    )
+    row = fetchone_params(sql, (log_id,))
+
+    job = SYNC_JOBS.get(database, log_id)
+    if job:
+        return jsonify(job.to_dict()), 200
+
+    if row:
+        return jsonify({
+            "id": row[0],
+            "database": database,
+            "syncType": row[1],
+            "status": 'running' if row[2] == 'started' else row[2],
+            "error": row[5],
+            "progress": {"users_synced": row[3], "photos_synced": row[4]},
+            "startedAt": row[6].isoformat() if row[6] else None,
+            "completedAt": row[7].isoformat() if row[7] else None,
+        }), 200
+
+    return jsonify(status=404, message="Not Found"), 404
+
+
+def start_sync(database, sync_type, work, message):
+    """Start a Google sync: work(job, google_client, log_id) -> result dict.
     
+    Runs inline for ?wait=true, otherwise on SYNC_JOBS with a copy of
+    the request context (for the credentials and X- headers). Only one
+    sync runs per database at a time, across processes too (a MySQL
+    GET_LOCK held for the job's lifetime); a repeated request gets the
+    running job's id back.
+    """
     if not GOOGLE_AVAILABLE:
         return jsonify(status=503, message="Google API not configured"), 503
-    
+
+    google_client = create_client_from_env()
+    if not google_client:
+        return jsonify(status=503,
+                       message="Google credentials not configured"), 503
+
+    job, new = SYNC_JOBS.reserve(database, sync_type)
+    if not new:
+        return sync_running(job.kind, job.id, sync_type)
+
+    # Other processes (workers, hosts) take the same lock in MySQL.
     try:
-        google_client = create_client_from_env()
-        if not google_client:
-            return jsonify(status=503,
-                         message="Google credentials not configured"), 503
-        
-        # Log sync start
-        log_id = log_sync_start(database, 'photo')
-        
-        # Get all user IDs from database
-        sql = "SELECT id, primary_email FROM " + database + ".google_users"
-        users = fetchall(sql)
-        
-        photos_synced = 0
-        for user_row in users:
-            user_id = user_row[0]
-            email = user_row[1]
-            
-            # Fetch photo from Google
-            photo_result = google_client.get_user_photo(email)
-            if photo_result:
-                photo_data, mime_type = photo_result
-                if sync_photo_to_db(database, user_id, photo_data, mime_type):
-                    photos_synced += 1
-        
-        # Log sync completion
-        log_sync_complete(database, log_id, 0, photos_synced)
-        
-        return jsonify(status=201,
-                      message="Photo sync completed",
-                      photos_synced=photos_synced), 201
-                      
+        lock = acquire_sync_lock(database)
+    except Exception:
+        SYNC_JOBS.release(job)
+        raise
+    if lock is None:
+        SYNC_JOBS.release(job)
+        row = fetchone_params("SELECT id, sync_type FROM " + database + ".google_sync_log "
+                              "WHERE sync_status=%s ORDER BY id DESC LIMIT 1", ('started',))
+        return sync_running(row[1] if row else None, row[0] if row else None, sync_type)
+
+    # Holding the lock, no sync runs anywhere: older 'started' entries were cut short.
+    fail_stale_syncs(database)
+
+    # Log sync start
+    log_id = log_sync_start(database, sync_type)
+    if log_id is None:
+        close_sync_lock(lock)
+        SYNC_JOBS.release(job)
+        return jsonify(status=500, message="Could not create google_sync_log entry"), 500
+    job.id = log_id
+
+    if request.args.get('wait', '').lower() in ['1', 'true', 'yes']:
+        try:
+            result = run_sync_job(job, work, google_client, log_id, lock)
+        except Exception as e:
+            return jsonify(status=500, message=str(e)), 500
+        finally:
+            SYNC_JOBS.release(job)
+        return jsonify(status=201, message=message, **result), 201
+
+    SYNC_JOBS.start(job, log_id, copy_current_request_context(run_sync_job),
+                    work, google_client, log_id, lock)
+
+    return jsonify(status=202, message="Sync started", id=log_id), 202
+
+
+def sync_running(kind, job_id, sync_type):
+    """Response to a sync request while a kind sync (job_id) is running."""
+    if kind != sync_type:
+        return jsonify(status=409,
+                       message="A " + (kind or "Google") + " sync is already running",
+                       id=job_id), 409
+    return jsonify(status=202, message="Sync already running", id=job_id), 202
+
+
+def run_sync_job(job, work, google_client, log_id, lock):
+    """Run one sync, logging failure to google_sync_log; releases the sync lock."""
+    try:
+        result = work(job, google_client, log_id)
     except Exception as e:
-        log_sync_failed(database, log_id, str(e))
-        return jsonify(status=500, message=str(e)), 500
+        log_sync_failed(job.database, log_id, str(e))
+        raise
+    finally:
+        close_sync_lock(lock)
+    job.progress.update(result)
+    return result
+
+
+def sync_users_job(job, google_client, log_id):
+    """Sync job: Google users -> google_users."""
+    database = job.database
+
+    # Fetch all users from Google
+    job.progress['stage'] = 'listing users'
+    users = google_client.list_all_users()
+
+    # Write only new, changed and removed users
+    job.progress.update(stage='writing users', users_total=len(users))
+    inserted, updated, deleted = sync_users_to_db(database, users)
+    users_synced = inserted + updated
+
+    # Rebuild the external_id index now rather than on the next request
+    load_google_user_index(sql_connection(), (sql_identity(), database), database)
+
+    # Log sync completion
+    log_sync_complete(database, log_id, users_synced, 0,
+                      users_inserted=inserted,
+                      users_updated=updated,
+                      users_deleted=deleted)
+
+    job.progress['stage'] = 'done'
+    return {'users_synced': users_synced,
+            'users_inserted': inserted,
+            'users_updated': updated,
+            'users_deleted': deleted,
+            'users_unchanged': len(users) - users_synced}
+
+
+def sync_photos_job(job, google_client, log_id):
+    """Sync job: Google user photos -> google_user_photos."""
+    database = job.database
+
+    # Get all user IDs from database
+    sql = "SELECT id, primary_email FROM " + database + ".google_users"
+    users = fetchall(sql)
+
+    job.progress.update(stage='syncing photos', users_total=len(users))
+    photos_synced, photos_failed = sync_photos(database, google_client, users, log_id, job.progress)
+
+    # Log sync completion
+    log_sync_complete(database, log_id, 0, photos_synced, photos_failed=photos_failed)
+
+    job.progress['stage'] = 'done'
+    return {'photos_synced': photos_synced, 'photos_failed': photos_failed}
+
+
+def sync_photos(database, google_client, users, log_id, progress=None):
+    """Fetch user photos from Google concurrently and store them in batches.
+
+    Google calls fan out over GOOGLE_SYNC_WORKERS threads (rate limited
+    and retried by the client); rows are written from this thread with
+    multi-row REPLACE statements of PHOTO_SYNC_BATCH photos, and progress
+    is recorded in google_sync_log after every batch.
+
+    Args:
+        database: Database name
+        google_client: GoogleDirectoryClient
+        users: Rows of (id, primary_email)
+        log_id: google_sync_log entry ID
+        progress: Optional dict updated with live counters
+
+    Returns:
+        Tuple of (photos stored, photos that could not be stored)
+    """
+    if progress is None:
+        progress = {}
+    progress.update(users_processed=0, photos_synced=0, photos_failed=0)
+
+    def fetch(user_id, email):
+        try:
+            return user_id, google_client.get_user_photo(email)
+        except Exception as e:  # pylint: disable=broad-except
+            print(f"Error fetching photo for {email}: {e}")
+            return user_id, None
+
+    photos_synced = 0
+    photos_failed = 0
+    photos = []
+
+    def collect(done):
+        for future in done:
+            user_id, photo_result = future.result()
+            progress['users_processed'] += 1
+            if photo_result:
+                photos.append((user_id, photo_result[0], photo_result[1]))
+
+    with ThreadPoolExecutor(max_workers=GOOGLE_SYNC_WORKERS) as executor:
+        pending = set()
+        for user_row in users:
+            pending.add(executor.submit(fetch, user_row[0], user_row[1]))
+
+            # Keep a bounded window in flight so fetched photos do not pile up.
+            if len(pending) >= GOOGLE_SYNC_WORKERS * 4:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+
+            if len(photos) >= PHOTO_SYNC_BATCH:
+                stored = sync_photos_to_db(database, photos)
+                photos_synced += stored
+                photos_failed += len(photos) - stored
+                photos = []
+                progress.update(photos_synced=photos_synced, photos_failed=photos_failed)
+                log_sync_progress(database, log_id, 0, photos_synced)
+
+        collect(wait(pending)[0])
+
+    if photos:
+        stored = sync_photos_to_db(database, photos)
+        photos_synced += stored
+        photos_failed += len(photos) - stored
+
+    progress.update(photos_synced=photos_synced, photos_failed=photos_failed)
+    return photos_synced, photos_failed
 
 
 @APP.route("/api/<database>/google/users", methods=['GET'])
@@ -298,34 +794,43 @@ def get_google_users(database=None):
     """
     database = request.view_args['database']
     limit = request.args.get("limit", None)
-    
+
+    try:
+        page = page_args()
+    except ValueError as e:
+        return jsonify(status=400, message=str(e)), 400
+
     sql = (
         "SELECT id, primary_email, given_name, family_name, external_id, "
         "department, org_description, suspended, is_admin, last_login_time, synced_at "
-        "FROM " + database + ".google_users ORDER BY primary_email"
+        "FROM " + database + ".google_users"
     )
+
+    if page:
+        if limit:
+            return jsonify(status=400, message="limit can not be combined with after/page_size"), 400
+        after, page_size = page
+        try:
+            sql, params = keyset_sql(sql, ['primary_email'], after, page_size)
+        except ValueError as e:
+            return jsonify(status=400, message=str(e)), 400
+        rows = cached_read(database, ['google_users'], sql, params, lambda: fetchall_params(sql, params))
+        more = len(rows) > page_size
+        rows = rows[:page_size]
+        next_cursor = encode_cursor([rows[-1][1]]) if more else None
+        return jsonify(rows=[google_user_dict(row) for row in rows], next=next_cursor), 200
+
+    sql += " ORDER BY primary_email"
+
+    try:
+        sql += query.parse_limit(limit)
+    except query.QueryError as e:
+        return jsonify(status=400, message=str(e)), 400
     
-    if limit:
-        sql += " LIMIT " + limit
-    
-    rows = fetchall(sql)
+    rows = cached_read(database, ['google_users'], sql, (), lambda: fetchall(sql))
     
     if rows:
-        result = []
-        for row in rows:
-            result.append({
-                "id": row[0],
-                "primaryEmail": row[1],
-                "givenName": row[2],
-                "familyName": row[3],
-                "externalId": row[4],
-                "department": row[5],
-                "orgDescription": row[6],
-                "suspended": bool(row[7]),
-                "isAdmin": bool(row[8]),
-                "lastLoginTime": row[9].isoformat() if row[9] else None,
-                "syncedAt": row[10].isoformat() if row[10] else None,
-            })
+        result = [google_user_dict(row) for row in rows]
         return jsonify(result), 200
     
     return jsonify(status=404, message="Not Found"), 404
@@ -344,34 +849,141 @@ def get_google_user(database=None, userKey=None):
     database = request.view_args['database']
     user_key = request.view_args['userKey']
     
-    # Treat userKey strictly as external_id (Google userID)
+    # Treat userKey strictly as external_id (Google userID). The index
+    # only answers known misses; anything else is one query.
+    key, table = google_user_table(database, wait=False)
+    ref = GOOGLE_USER_INDEX.lookup(table, user_key) if table is not None else None
+    if ref is None and GOOGLE_USER_INDEX.is_negative(key, user_key):
+        return jsonify(status=404, message="Not Found"), 404
+
     sql = (
         "SELECT id, primary_email, given_name, family_name, external_id, "
         "department, org_description, suspended, is_admin, last_login_time, synced_at "
         "FROM " + database + ".google_users "
-        "WHERE external_id=%s LIMIT 1"
+        "WHERE " + ("id" if ref else "external_id") + "=%s LIMIT 1"
     )
     
-    row = fetchone_params(sql, (user_key,))
+    row = fetchone_prepared(sql, (ref[0] if ref else user_key,))
+    if ref is None:
+        GOOGLE_USER_INDEX.add(key, user_key, (row[0], row[1]) if row else None)
     
     if row:
-        return jsonify({
-            "id": row[0],
-            "primaryEmail": row[1],
-            "givenName": row[2],
-            "familyName": row[3],
-            "externalId": row[4],
-            "department": row[5],
-            "orgDescription": row[6],
-            "suspended": bool(row[7]),
-            "isAdmin": bool(row[8]),
-            "lastLoginTime": row[9].isoformat() if row[9] else None,
-            "syncedAt": row[10].isoformat() if row[10] else None,
-        }), 200
+        return jsonify(google_user_dict(row)), 200
     
     return jsonify(status=404, message="Not Found"), 404
 
 
+def google_user_table(database, wait=True):
+    """google: (index key, external_id -> (id, primary_email) table) for database.
+
+    See index_table; the table is None if not wait and it is not loaded yet.
+    """
+    key = (sql_identity(), database)
+    return key, index_table(GOOGLE_USER_INDEX, key,
+                            lambda cnx: load_google_user_index(cnx, key, database), wait)
+
+
+def load_google_user_index(cnx, key, database):
+    """google: read the external_id index for database in one query on cnx (closed after)."""
+    stamp = GOOGLE_USER_INDEX.stamp()
+    sql = (
+        "SELECT external_id, id, primary_email FROM " + database + ".google_users "
+        "WHERE external_id IS NOT NULL"
+    )
+    cur = cnx.cursor(buffered=True)
+    try:
+        cur.execute(sql)
+        rows = cur.fetchall()
+    finally:
+        cur.close()
+        cnx.close()
+    table = {}
+    for row in rows:
+        table.setdefault(row[0], (row[1], row[2]))
+    GOOGLE_USER_INDEX.load(key, table, stamp)
+    return table
+
+
+def google_user_ref(database, user_key):
+    """google: (id, primary_email) of the user with external_id user_key, or None."""
+    key, table = google_user_table(database)
+    ref = GOOGLE_USER_INDEX.lookup(table, user_key)
+
+    # Not in the bulk load: added since, unless just found missing
+    if ref is None and not GOOGLE_USER_INDEX.is_negative(key, user_key):
+        sql = (
+            "SELECT id, primary_email FROM " + database + ".google_users "
+            "WHERE external_id=%s LIMIT 1"
+        )
+        ref = fetchone_prepared(sql, (user_key,))
+        GOOGLE_USER_INDEX.add(key, user_key, tuple(ref) if ref else None)
+    return ref
+
+
+def google_photo_meta(database, user_key):
+    """google: (user id, (content_hash, mime_type, synced_at) or None) for userKey.
+
+    The user id comes from the external_id index; a user missing from it
+    is resolved together with its photo metadata in one JOIN. user id is
+    None if there is no such user.
+    """
+    key, table = google_user_table(database, wait=False)
+    ref = GOOGLE_USER_INDEX.lookup(table, user_key) if table is not None else None
+
+    if ref is not None:
+        sql = (
+            "SELECT content_hash, mime_type, UNIX_TIMESTAMP(synced_at) "
+            "FROM " + database + ".google_user_photos WHERE user_id=%s LIMIT 1"
+        )
+        return ref[0], photo_meta(fetchone_prepared(sql, (ref[0],)))
+
+    if GOOGLE_USER_INDEX.is_negative(key, user_key):
+        return None, None
+
+    sql = (
+        "SELECT u.id, u.primary_email, p.user_id, p.content_hash, p.mime_type, "
+        "UNIX_TIMESTAMP(p.synced_at) "
+        "FROM " + database + ".google_users u "
+        "LEFT JOIN " + database + ".google_user_photos p ON p.user_id = u.id "
+        "WHERE u.external_id=%s LIMIT 1"
+    )
+    row = fetchone_prepared(sql, (user_key,))
+    GOOGLE_USER_INDEX.add(key, user_key, (row[0], row[1]) if row else None)
+    if not row:
+        return None, None
+    return row[0], (photo_meta(row[3:]) if row[2] is not None else None)
+
+
+def photo_meta(row):
+    """google: (content_hash, mime_type, UNIX_TIMESTAMP(synced_at)) -> synced_at as UTC datetime.
+
+    The synced_at TIMESTAMP reads back as wall clock in the session time
+    zone; UNIX_TIMESTAMP() gives the stored instant itself, so
+    Last-Modified is right whatever the session's time_zone.
+    """
+    if not row:
+        return row
+    synced_at = datetime.fromtimestamp(float(row[2]), timezone.utc) if row[2] is not None else None
+    return row[0], row[1], synced_at
+
+
+def google_user_dict(row):
+    """google_users row -> API user dict."""
+    return {
+        "id": row[0],
+        "primaryEmail": row[1],
+        "givenName": row[2],
+        "familyName": row[3],
+        "externalId": row[4],
+        "department": row[5],
+        "orgDescription": row[6],
+        "suspended": bool(row[7]),
+        "isAdmin": bool(row[8]),
+        "lastLoginTime": row[9].isoformat() if row[9] else None,
+        "syncedAt": row[10].isoformat() if row[10] else None,
+    }
+
+
 @APP.route("/api/<database>/google/users/<userKey>/photo", methods=['GET'])
 def get_google_user_photo(database=None, userKey=None):
     """GET: /api/<database>/google/users/<userKey>/photo.
@@ -384,12 +996,23 @@ def get_google_user_photo(database=None, userKey=None):
     - datauri=true     Return JSON with {photoUrl: data:image/...}
     - format=datauri   Same as datauri=true
     - raw=1            Force binary response even if datauri requested
+    - size=64|128|256  Thumbnail scaled to fit size x size (source=db only)
+    - webp=1           Re-encode as WebP (source=db only)
     
+    Thumbnails and WebP need Pillow; they are generated on first request
+    and stored in google_user_photo_variants until the photo changes.
+
+    Photos from the database carry a strong ETag (the stored content
+    hash), Last-Modified (synced_at) and DB_API_PHOTO_CACHE_CONTROL; a
+    matching If-None-Match / If-Modified-Since gets 304 without the
+    photo being read.
+
     Response (binary): 200 image bytes
     Response (JSON Data URI): {"photoUrl": "data:<mime>;base64,....", "mimeType": str, "externalId": str, "source": str}
     
     Response:
     - 200: Binary image data
+    - 304: Not Modified
     - 404: {"status": 404, "message": "Not Found"}
     """
     database = request.view_args['database']
@@ -403,6 +1026,17 @@ def get_google_user_photo(database=None, userKey=None):
         # Respect explicit JSON Accept preference
         want_data_uri = True
     force_raw = request.args.get('raw', '').lower() in ['1', 'true', 'yes'] or request.args.get('format', '').lower() == 'binary'
+
+    size = request.args.get('size', '')
+    want_webp = request.args.get('webp', '').lower() in ['1', 'true', 'yes']
+    variant = None
+    if size or want_webp:
+        if size and (not size.isdigit() or int(size) not in thumbnails.SIZES):
+            return jsonify(status=400, message="size must be one of " +
+                           ", ".join(str(s) for s in thumbnails.SIZES)), 400
+        if not thumbnails.AVAILABLE:
+            return jsonify(status=503, message="Image resizing not available (Pillow not installed)"), 503
+        variant = (int(size or 0), 'webp' if want_webp else 'native')
     
     # If source=live, fetch directly from Google Directory API via backend
     if source == 'live':
@@ -413,22 +1047,12 @@ def get_google_user_photo(database=None, userKey=None):
         if not google_client:
             return jsonify(status=503, message="Google credentials not configured"), 503
 
-        # Resolve primary email using external_id (userKey)
-        sql_email = (
-            "SELECT primary_email FROM " + database + ".google_users "
-            "WHERE external_id=%s LIMIT 1"
-        )
-        email_row = fetchone_params(sql_email, (user_key,))
-        if not email_row:
+        # Resolve id and primary email using external_id (userKey)
+        id_row = google_user_ref(database, user_key)
+        if not id_row:
             return jsonify(status=404, message="User not found"), 404
 
-        primary_email = email_row[0]
-        # Also get internal numeric id for caching
-        sql_id = (
-            "SELECT id FROM " + database + ".google_users "
-            "WHERE external_id=%s LIMIT 1"
-        )
-        id_row = fetchone_params(sql_id, (user_key,))
+        primary_email = id_row[1]
         try:
             photo_result = google_client.get_user_photo(primary_email)
             if photo_result:
@@ -480,25 +1104,49 @@ def get_google_user_photo(database=None, userKey=None):
         except Exception as e:
             return jsonify(status=500, message=str(e)), 500
 
+    as_data_uri = want_data_uri and not force_raw
+
+    # Recently served photos skip the database entirely
+    cache_key = (sql_identity(), database, user_key, variant)
+    cached = PHOTO_CACHE.get(cache_key)
+    if cached:
+        _user_id, content_hash, mime_type, synced_at, photo_bytes = cached
+        etag = photo_etag(content_hash, as_data_uri, variant)
+        if photo_not_modified(etag, synced_at):
+            return photo_cache_headers(Response(status=304), etag, synced_at)
+        return photo_response(photo_bytes, mime_type, user_key, as_data_uri, etag, synced_at)
+
     # Default: serve from synced database
     # Default DB fetch: resolve by external_id only
-    sql_user = (
-        "SELECT id FROM " + database + ".google_users "
-        "WHERE external_id=%s LIMIT 1"
-    )
-    user_row = fetchone_params(sql_user, (user_key,))
-    if not user_row:
+    # Validators first, without the blob, so revalidation costs no blob read.
+    user_id, meta_row = google_photo_meta(database, user_key)
+    if not user_id:
         return jsonify(status=404, message="User not found"), 404
 
-    user_id = user_row[0]
+    if not meta_row:
+        return jsonify(status=404, message="Photo not found"), 404
+
+    content_hash, mime_type, synced_at = meta_row
+    mime_type = mime_type or 'image/jpeg'
+
+    if content_hash:
+        etag = photo_etag(content_hash, as_data_uri, variant)
+        if photo_not_modified(etag, synced_at):
+            return photo_cache_headers(Response(status=304), etag, synced_at)
+
+        if variant:
+            stored = fetch_photo_variant(database, user_id, content_hash, variant)
+            if stored:
+                PHOTO_CACHE.set(cache_key, (user_id, content_hash, stored[1], synced_at, stored[0]))
+                return photo_response(stored[0], stored[1], user_key, as_data_uri, etag, synced_at)
+
     sql_photo = (
-        "SELECT photo_data, mime_type FROM " + database + ".google_user_photos "
+        "SELECT photo_data FROM " + database + ".google_user_photos "
         "WHERE user_id=%s LIMIT 1"
     )
-    photo_row = fetchone_params(sql_photo, (user_id,))
+    photo_row = fetchone_prepared(sql_photo, (user_id,))
     if photo_row and photo_row[0]:
         photo_data = photo_row[0]
-        mime_type = photo_row[1] or 'image/jpeg'
         # Normalize
         try:
             if isinstance(photo_data, (bytes, bytearray)):
@@ -514,17 +1162,68 @@ def get_google_user_photo(database=None, userKey=None):
         except Exception:
             return jsonify(status=404, message="Photo decode failed"), 404
 
-        if want_data_uri and not force_raw:
-            b64 = base64.b64encode(photo_bytes).decode('ascii')
-            data_uri = f"data:{mime_type};base64,{b64}"
-            return jsonify(photoUrl=data_uri,
+        # Rows stored before content_hash existed
+        if not content_hash:
+            content_hash = hashlib.sha256(photo_bytes).hexdigest()
+            etag = photo_etag(content_hash, as_data_uri, variant)
+            if photo_not_modified(etag, synced_at):
+                return photo_cache_headers(Response(status=304), etag, synced_at)
+
+        if variant:
+            try:
+                photo_bytes, mime_type = thumbnails.render(photo_bytes, *variant)
+            except Exception as e:
+                return jsonify(status=500, message=f"Photo resize failed: {e}"), 500
+            store_photo_variant(database, user_id, content_hash, variant, photo_bytes, mime_type)
+
+        PHOTO_CACHE.set(cache_key, (user_id, content_hash, mime_type, synced_at, photo_bytes))
+        return photo_response(photo_bytes, mime_type, user_key, as_data_uri, etag, synced_at)
+
+    return jsonify(status=404, message="Photo not found"), 404
+
+
+def photo_response(photo_bytes, mime_type, user_key, data_uri, etag, last_modified):
+    """photo: binary or data URI response with cache headers."""
+    if data_uri:
+        b64 = base64.b64encode(photo_bytes).decode('ascii')
+        response = jsonify(photoUrl=f"data:{mime_type};base64,{b64}",
                            mimeType=mime_type,
                            externalId=user_key,
-                           source='db'), 200
+                           source='db')
+    else:
+        response = send_file(BytesIO(photo_bytes), mimetype=mime_type, as_attachment=False)
+    return photo_cache_headers(response, etag, last_modified)
 
-        return send_file(BytesIO(photo_bytes), mimetype=mime_type, as_attachment=False)
 
-    return jsonify(status=404, message="Photo not found"), 404
+def photo_etag(content_hash, data_uri=False, variant=None):
+    """photo: strong ETag value for a stored photo representation."""
+    etag = content_hash
+    if variant:
+        etag += '-%d%s' % (variant[0], '-webp' if variant[1] == 'webp' else '')
+    return etag + ('-datauri' if data_uri else '')
+
+
+def photo_not_modified(etag, last_modified):
+    """photo: True if the request's validators match (If-None-Match wins)."""
+    if request.if_none_match:
+        # Weak comparison: compression turns the ETag weak
+        return request.if_none_match.contains_weak(etag)
+
+    if request.if_modified_since and last_modified:
+        last_modified = last_modified.replace(microsecond=0)
+        return last_modified <= request.if_modified_since
+
+    return False
+
+
+def photo_cache_headers(response, etag, last_modified):
+    """photo: add ETag, Last-Modified and Cache-Control to response."""
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    response.headers['Cache-Control'] = PHOTO_CACHE_CONTROL
+    response.vary.add('Accept')
+    return response
 
 
 @APP.route("/api/<database>/attendance/log", methods=['POST'])
@@ -539,10 +1238,19 @@ def log_user_attendance(database=None):
         "primaryEmail": "string"
     }
     
+    With DB_API_ATTENDANCE_WRITE_BEHIND enabled, rows are queued and
+    written in multi-row batches by a background flusher; a batch is
+    retried on lost connections, lock timeouts and deadlocks
+    (DB_API_ATTENDANCE_RETRIES) and written row by row on other errors.
+    Query params: ack=queued (reply 202 once queued) or ack=durable
+    (reply 201 once written); default DB_API_ATTENDANCE_ACK.
+
     Response:
     - 201: {"status": 201, "message": "Attendance logged", "id": int}
+    - 202: {"status": 202, "message": "Attendance queued"}
     - 400: {"status": 400, "message": "Missing required fields"}
     - 500: {"status": 500, "message": error message}
+    - 503: {"status": 503, "message": "Attendance queue full"}
     """
     database = request.view_args['database']
     
@@ -558,26 +1266,21 @@ def log_user_attendance(database=None):
         return jsonify(status=400, 
                       message="Missing required fields: userID and primaryEmail"), 400
     
+    if ATTENDANCE_WRITE_BEHIND:
+        return queue_attendance(database, user_id, primary_email)
+
     try:
         # Get current datetime
         login_time = datetime.now()
         
         # Insert attendance record
-        cnx = sql_connection()
-        cur = cnx.cursor(buffered=True)
-        
         sql = (
             "INSERT INTO " + database + ".user_attendance "
             "(user_id, primary_email, login_time) VALUES (%s, %s, %s)"
         )
         
-        cur.execute(sql, (user_id, primary_email, login_time))
-        cnx.commit()
-        
-        attendance_id = cur.lastrowid
-        
-        cur.close()
-        cnx.close()
+        attendance_id = sqlexec_prepared(sql, (user_id, primary_email, login_time))
+        table_written(database, 'user_attendance')
         
         return jsonify(status=201,
                       message="Attendance logged",
@@ -588,6 +1291,61 @@ def log_user_attendance(database=None):
         return jsonify(status=500, message=str(e)), 500
 
 
+def queue_attendance(database, user_id, primary_email):
+    """attendance: queue a row for the write-behind flusher."""
+    ack = request.args.get('ack', ATTENDANCE_ACK).lower()
+    if ack not in ['queued', 'durable']:
+        return jsonify(status=400, message="ack must be queued or durable"), 400
+
+    login_time = datetime.now()
+    config = sql_config()
+
+    try:
+        ticket = ATTENDANCE_QUEUE.submit(config, (pool.pool_key(config), database),
+                                         (user_id, primary_email, login_time),
+                                         timeout=ATTENDANCE_PUT_TIMEOUT)
+    except queue.Full:
+        response = jsonify(status=503, message="Attendance queue full")
+        response.headers['Retry-After'] = '1'
+        return response, 503
+
+    if ack == 'queued':
+        return jsonify(status=202,
+                       message="Attendance queued",
+                       loginTime=login_time.isoformat()), 202
+
+    if not ticket.wait(ATTENDANCE_ACK_TIMEOUT):
+        return jsonify(status=504, message="Attendance write timed out"), 504
+
+    if ticket.error:
+        return jsonify(status=500, message=ticket.error), 500
+
+    return jsonify(status=201,
+                   message="Attendance logged",
+                   id=ticket.rowid,
+                   loginTime=login_time.isoformat()), 201
+
+
+def flush_attendance(config, key, rows):
+    """attendance: write queued rows in one multi-row INSERT, return the first id."""
+    database = key[1]
+    sql = (
+        "INSERT INTO " + database + ".user_attendance "
+        "(user_id, primary_email, login_time) VALUES (%s, %s, %s)"
+    )
+
+    cnx = pool.connect(config)
+    cur = cnx.cursor(buffered=True)
+    try:
+        cur.executemany(sql, rows)
+        cnx.commit()
+        return cur.lastrowid
+    finally:
+        cur.close()
+        cnx.close()
+        table_written(database, 'user_attendance')
+
+
 @APP.route("/api", methods=['POST'])
 def post_api():
     """POST: /api."""
@@ -627,10 +1385,22 @@ def post_api():
 def post_insert(database=None, table=None):
     """POST: /api/<database>/<table>."""
     # Create a new row. key1=val1,key2=val2.
+    # A JSON array or an application/x-ndjson body inserts many rows.
     database = request.view_args['database']
     table = request.view_args['table']
 
+    if request.mimetype == 'application/x-ndjson':
+        try:
+            rows = [json.loads(line) for line in request.get_data(as_text=True).splitlines()
+                    if line.strip()]
+        except ValueError as e:
+            return jsonify(status=400, message="Invalid NDJSON: " + str(e), insert=False), 400
+        return post_json_many(database, table, rows)
+
     if request.is_json:
+        post = request.get_json()
+        if isinstance(post, list):
+            return post_json_many(database, table, post)
         return post_json(database, table)
 
     if request.form:
@@ -658,6 +1428,7 @@ def delete_one(database=None, table=None, key=None):
     sql += " WHERE " + column + "='" + key + "'"
 
     delete = sqlcommit(sql)
+    table_written(database, table)
 
     if delete > 0:
         return jsonify(status=211, message="Deleted", delete=True), 211
@@ -695,6 +1466,7 @@ def patch_one(database=None, table=None, key=None):
     sql += " SET " + field + "='" + value + "' WHERE " + column + "='" + key + "'"
 
     update = sqlcommit(sql)
+    table_written(database, table)
 
     if update > 0:
         return jsonify(status=201, message="Created", update=True), 201
@@ -706,6 +1478,7 @@ def patch_one(database=None, table=None, key=None):
 def put_replace(database=None, table=None):
     """PUT: /api/<database>/<table>."""
     # Replace existing row with new row. key1=val1,key2=val2."""
+    # A JSON array (or ?upsert=1) upserts rows instead, see put_upsert.
     database = request.view_args['database']
     table = request.view_args['table']
 
@@ -714,6 +1487,11 @@ def put_replace(database=None, table=None):
 
     post = request.get_json()
 
+    if isinstance(post, list):
+        return put_upsert(database, table, post)
+    if request.args.get("upsert", '').lower() in ['1', 'true', 'yes']:
+        return put_upsert(database, table, [post])
+
     placeholders = ['%s'] * len(post)
 
     fields = ",".join([str(key) for key in post])
@@ -727,6 +1505,7 @@ def put_replace(database=None, table=None):
     sql += " (" + fields + ") VALUES (" + places + ")"
 
     replace = sqlexec(sql, records)
+    table_written(database, table)
 
     if replace > 0:
         return jsonify(status=201,
@@ -737,6 +1516,146 @@ def put_replace(database=None, table=None):
     return jsonify(status=461, message="Failed Create", replace=False), 461
 
 
+def put_upsert(database, table, rows):
+    """put: rows as batched INSERT ... ON DUPLICATE KEY UPDATE, one transaction.
+
+    Unlike REPLACE an existing row is updated in place: no delete, no
+    cascades, no new auto-increment id. ?update=col1,col2 picks the
+    columns overwritten on a duplicate key (default: every non primary
+    key column sent); ?batch= rows per statement.
+    """
+    if not rows or not all(isinstance(row, dict) and row for row in rows):
+        return jsonify(status=400,
+                       message="Expected a non-empty list of JSON objects",
+                       upsert=False), 400
+
+    columns = list(rows[0])
+    if any(set(row) != set(columns) for row in rows):
+        return jsonify(status=400,
+                       message="All rows must have the same fields",
+                       upsert=False), 400
+
+    unknown = unknown_columns(database, table, ",".join(columns))
+    if unknown:
+        return jsonify(status=400, message="Unknown column: " + ",".join(unknown), upsert=False), 400
+
+    if "update" in request.args:
+        update = [name.strip() for name in request.args.get("update").split(',') if name.strip()]
+        missing = [name for name in update if name not in columns]
+        if missing:
+            return jsonify(status=400, message="update columns must be sent in every row: " +
+                           ",".join(missing), upsert=False), 400
+    else:
+        keys = set(key.lower() for key in primary_key(database, table))
+        update = [column for column in columns if column.lower() not in keys]
+
+    try:
+        batch = int(request.args.get("batch", INSERT_BATCH))
+    except ValueError:
+        batch = 0
+    if batch < 1:
+        return jsonify(status=400, message="batch must be a positive integer", upsert=False), 400
+
+    records = [tuple(row[column] for column in columns) for row in rows]
+
+    cnx = sql_connection()
+    try:
+        cur = cnx.cursor(cursor_class=upsert.InfoCursor)
+    except mysql.connector.errors.ProgrammingError:
+        # C extension connection (X-Pure: false): counts only for single rows
+        cur = cnx.cursor()
+    try:
+        batches = upsert.run(cnx, cur, database + "." + table, columns, update, records, batch)
+        cnx.commit()
+    except Exception:
+        cnx.rollback()
+        raise
+    finally:
+        cur.close()
+        cnx.close()
+        table_written(database, table)
+
+    def total(name):
+        """Sum of a count over batches, None if any batch could not tell."""
+        values = [b[name] for b in batches]
+        return None if None in values else sum(values)
+
+    return jsonify(status=200,
+                   message="OK",
+                   upsert=True,
+                   rowcount=len(records),
+                   inserted=total('inserted'),
+                   updated=total('updated'),
+                   unchanged=total('unchanged'),
+                   batches=batches), 200
+
+
+@APP.route("/api/<database>/_batch", methods=['POST'])
+def post_batch(database=None):
+    """POST: /api/<database>/_batch -> run operations in one transaction.
+
+    Insert, replace, update and delete operations (see batch.py) run in
+    order on one connection and are committed together.
+
+    Body:
+    - {"operations": [{"op", "table", "values", "key", "column"}, ...],
+       "savepoints": false}  (or just the operations array)
+
+    Response:
+    - 200: {"committed": true, "results": [{"op", "table", "rowcount", "rowid"|"error"}, ...]}
+    - 400: malformed batch, unknown table or column (nothing executed)
+    - 409: {"committed": false, "failed": index, "error"} (everything rolled back)
+    """
+    database = request.view_args['database']
+
+    if not request.is_json:
+        return jsonify(status=415, errorType="Unsupported Media Type", post='json'), 415
+
+    try:
+        operations, savepoints = txbatch.parse(database, request.get_json(),
+                                               lambda table: batch_columns(database, table),
+                                               BATCH_MAX)
+    except txbatch.BatchError as e:
+        return jsonify(status=400, message=str(e), committed=False), 400
+
+    cnx = sql_connection()
+    cur = cnx.cursor(buffered=True)
+    try:
+        results = txbatch.run(cur, operations, savepoints)
+        cnx.commit()
+    except txbatch.Failed as e:
+        cnx.rollback()
+        return jsonify(status=409,
+                       message="Rolled Back",
+                       committed=False,
+                       failed=e.index,
+                       error=str(e.error)), 409
+    except Exception:
+        cnx.rollback()
+        raise
+    finally:
+        cur.close()
+        cnx.close()
+        for table in set(operation.table for operation in operations):
+            table_written(database, table)
+
+    return jsonify(status=200, message="OK", committed=True, results=results), 200
+
+
+def batch_columns(database, table):
+    """sql: column names of database.table, [] if there is no such table."""
+    try:
+        return [row[0] for row in table_fields(database, table)]
+    except mysql.connector.errors.ProgrammingError:
+        return []
+
+
+@APP.after_request
+def compress_response(response):
+    """after_request: compress the body if the client accepts it."""
+    return compress.compress_response(response, request.accept_encodings)
+
+
 @APP.errorhandler(404)
 def not_found(_e=None):
     """Not_Found: HTTP File Not Found 404."""
@@ -778,29 +1697,87 @@ def handle_exception(_e):
 
 
 def post_sql():
-    """post: sql."""
-    post = request.data
-    sql = post.decode('utf-8')
+    """post: sql script (text/sql).
+
+    Every statement runs. The response is the first statement's result
+    unless ?stream=1 (or Accept: application/x-ndjson) asks for every
+    result as NDJSON frames (see script.frames). ?transaction=1 commits
+    the script as a whole and rolls it back on error, otherwise each
+    statement commits once its results are read (the whole script at
+    the end with connectors that can not split it, see script.results);
+    ?timeout=seconds bounds each statement.
+    """
+    sql = request.data.decode('utf-8')
+
+    try:
+        timeout = float(request.args.get('timeout', SQL_TIMEOUT))
+    except ValueError:
+        return jsonify(status=400, message="timeout must be a number of seconds"), 400
+    transaction = request.args.get('transaction', '').lower() in ['1', 'true', 'yes']
+    want_stream = (request.args.get('stream', '').lower() in ['1', 'true', 'yes', 'ndjson'] or
+                   'application/x-ndjson' in request.headers.get('Accept', ''))
 
     cnx = sql_connection()
-    cur = cnx.cursor(buffered=True)
+    cur = cnx.cursor(buffered=not want_stream)
+    set_timeout = script.timeout_sql(cnx.get_server_info() if timeout > 0 else None, timeout)
 
-    try:
-        for result in cur.execute(sql, multi=True):
+    if want_stream:
+        def generate():
+            try:
+                if set_timeout:
+                    cur.execute(set_timeout)
+                results = script.results(cnx, cur, sql, transaction)
+                for frame in script.frames(cnx, results, STREAM_BATCH, transaction):
+                    yield fastjson.dumps(frame) + "\n"
+            finally:
+                end_sql_script(cnx, cur, sql)
 
-            if result.with_rows:
-                return jsonify(result.fetchall()), 200
+        return Response(generate(), status=200, mimetype='application/x-ndjson')
 
-            cnx.commit()
-            return jsonify(status=201,
-                           statment=result.statement,
-                           rowcount=result.rowcount,
-                           lastrowid=result.lastrowid), 201
+    first = None
+    try:
+        if set_timeout:
+            cur.execute(set_timeout)
+        for _index, result in script.results(cnx, cur, sql, transaction):
+            if result.with_rows:
+                rows = result.fetchall()
+                if first is None:
+                    first = jsonify(rows), 200
+            elif first is None:
+                first = jsonify(status=201,
+                                statment=result.statement,
+                                rowcount=result.rowcount,
+                                lastrowid=result.lastrowid), 201
+        cnx.commit()
+    except script.Failed as e:
+        cnx.rollback()
+        raise e.error from e
+    except Exception:
+        cnx.rollback()
+        raise
     finally:
+        end_sql_script(cnx, cur, sql)
+
+    return first or (jsonify(status=202, method='POST'), 202)
+
+
+def end_sql_script(cnx, cur, sql):
+    """sql: release the connection with a clean session, drop caches."""
+    try:
         cur.close()
+    except Exception:  # pylint: disable=broad-except
+        # Unread result; the pool discards the connection on close.
+        pass
+    if isinstance(cnx, pool.PooledConnection):
+        # A script stopped midway may leave results of its query pending;
+        # nothing else can be sent on that connection, so it is not reused.
+        # Otherwise whatever the script set in the session is cleared.
+        cnx.close(discard=getattr(cnx, 'have_next_result', False), reset=True)
+    else:
         cnx.close()
-
-    return jsonify(status=202, method='POST'), 202
+    table_written()
+    if DDL_RE.search(sql):
+        SCHEMA_CACHE.invalidate()
 
 
 def post_json(database, table):
@@ -820,6 +1797,7 @@ def post_json(database, table):
     sql += " (" + fields + ") VALUES (" + places + ")"
 
     insert = sqlexec(sql, records)
+    table_written(database, table)
 
     if insert > 0:
         return jsonify(status=201,
@@ -830,6 +1808,49 @@ def post_json(database, table):
     return jsonify(status=461, message="Failed Create", insert=False), 461
 
 
+def post_json_many(database, table, rows):
+    """post: many json rows in multi-VALUES batches, one transaction."""
+    if not rows or not all(isinstance(row, dict) and row for row in rows):
+        return jsonify(status=400,
+                       message="Expected a non-empty list of JSON objects",
+                       insert=False), 400
+
+    columns = list(rows[0])
+    if any(set(row) != set(columns) for row in rows):
+        return jsonify(status=400,
+                       message="All rows must have the same fields",
+                       insert=False), 400
+
+    unknown = unknown_columns(database, table, ",".join(columns))
+    if unknown:
+        return jsonify(status=400, message="Unknown column: " + ",".join(unknown), insert=False), 400
+
+    try:
+        batch = int(request.args.get("batch", INSERT_BATCH))
+    except ValueError:
+        batch = 0
+    if batch < 1:
+        return jsonify(status=400, message="batch must be a positive integer", insert=False), 400
+
+    sql = "INSERT INTO " + database + "." + table
+    sql += " (" + ",".join(columns) + ") VALUES (" + ",".join(['%s'] * len(columns)) + ")"
+
+    records = [tuple(row[column] for column in columns) for row in rows]
+    batches = sqlexecmany(sql, records, batch)
+    table_written(database, table)
+
+    first = next((b['firstrowid'] for b in batches if b['firstrowid']), None)
+    last = next((b['lastrowid'] for b in reversed(batches) if b['lastrowid']), None)
+
+    return jsonify(status=201,
+                   message="Created",
+                   insert=True,
+                   rowcount=sum(b['rowcount'] for b in batches),
+                   firstrowid=first,
+                   lastrowid=last,
+                   batches=batches), 201
+
+
 def post_form(database, table):
     """post: form data application/x-www-form-urlencoded."""
     credentials = request.form.get('credentials', None)
@@ -857,6 +1878,7 @@ def post_form(database, table):
         sql += " (" + fields + ") VALUES (" + places + ")"
 
         insert = sqlinsert(sql, records, base64_user, base64_pass)
+        table_written(database, table)
 
         if insert > 0:
             return jsonify(status=201,
@@ -877,6 +1899,174 @@ def post_form(database, table):
                    insert=False), 401
 
 
+def stream_rows(head, batches, ndjson=False):
+    """stream: rows as a JSON array (or NDJSON) response.
+
+    head is the list of rows already read; batches yields the rest.
+    Rows go out in chunks of up to STREAM_BATCH rows.
+    """
+    def chunks():
+        for start in range(0, len(head), STREAM_BATCH):
+            yield head[start:start + STREAM_BATCH]
+        yield from batches
+
+    def generate():
+        try:
+            if ndjson:
+                for batch in chunks():
+                    yield "".join(fastjson.dumps(row) + "\n" for row in batch)
+                return
+
+            sep = "[\n"
+            for batch in chunks():
+                chunk = []
+                for row in batch:
+                    chunk.append(sep + fastjson.dumps(row))
+                    sep = ",\n"
+                yield "".join(chunk)
+            yield "[]\n" if sep == "[\n" else "\n]\n"
+        finally:
+            batches.close()
+
+    mimetype = 'application/x-ndjson' if ndjson else 'application/json'
+    return Response(generate(), status=200, mimetype=mimetype)
+
+
+def page_args():
+    """args: (after, page_size) for keyset pagination, or None if not paging.
+
+    Raises ValueError on a malformed cursor or page_size.
+    """
+    after = request.args.get("after", None)
+    page_size = request.args.get("page_size", None)
+
+    if after is None and page_size is None:
+        return None
+
+    try:
+        page_size = int(page_size) if page_size else PAGE_SIZE
+    except ValueError:
+        raise ValueError("page_size must be an integer") from None
+
+    if page_size < 1 or page_size > PAGE_MAX:
+        raise ValueError("page_size must be between 1 and " + str(PAGE_MAX))
+
+    return (decode_cursor(after) if after else None), page_size
+
+
+def keyset_sql(select, keys, after, page_size, where='', where_params=()):
+    """sql: add keyset WHERE/ORDER BY/LIMIT to select, return (sql, params).
+
+    where (with where_params) is an extra condition ANDed to the keyset one.
+    One extra row is fetched so callers can tell whether a next page exists.
+    """
+    params = list(where_params)
+    conditions = ["(" + where + ")"] if where else []
+    columns = [query.quote(key) for key in keys]
+
+    if after is not None:
+        if len(after) != len(keys):
+            raise ValueError("Cursor does not match table key")
+        if len(keys) == 1:
+            conditions.append(columns[0] + " > %s")
+        else:
+            conditions.append("(" + ",".join(columns) + ") > (" + ",".join(['%s'] * len(keys)) + ")")
+        params.extend(after)
+
+    sql = select
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+
+    sql += " ORDER BY " + ",".join(columns) + " LIMIT " + str(page_size + 1)
+    return sql, tuple(params)
+
+
+def encode_cursor(values):
+    """cursor: opaque token for the key values of the last row of a page.
+
+    Binary, date/time and DECIMAL values are tagged (resultcache.encode)
+    so they decode to the same type and compare as such.
+    """
+    data = resultcache.encode(list(values))
+    return base64.urlsafe_b64encode(data.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token):
+    """cursor: key values from an encode_cursor() token."""
+    try:
+        padded = token + '=' * ((4 - len(token) % 4) % 4)
+        values = resultcache.decode(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (ValueError, TypeError, ArithmeticError, UnicodeError):
+        raise ValueError("Invalid cursor") from None
+
+    if not isinstance(values, list) or not values or any(isinstance(value, (dict, list)) for value in values):
+        raise ValueError("Invalid cursor")
+    return values
+
+
+def primary_key(database, table):
+    """sql: primary key columns of database.table in index order."""
+    sql = "SHOW KEYS FROM " + database + "." + table + " WHERE Key_name = 'PRIMARY'"
+    rows = fetchall_schema(sql)
+    # Seq_in_index, Column_name
+    return [row[4] for row in sorted(rows, key=lambda row: row[3])]
+
+
+def table_fields(database, table):
+    """sql: SHOW FIELDS rows for database.table (cached)."""
+    return fetchall_schema("SHOW FIELDS FROM " + database + "." + table)
+
+
+def unknown_columns(database, table, fields):
+    """sql: names in comma separated fields that are not columns of database.table."""
+    names = [name.strip().strip('`') for name in fields.split(',')]
+    names = [name for name in names if name and name != '*']
+    if not names:
+        return []
+
+    columns = set(row[0].lower() for row in table_fields(database, table))
+    return [name for name in names if name.lower() not in columns]
+
+
+def cached_read(database, tables, sql, params, read):
+    """cache: read() (sql with params on database.tables) through RESULT_CACHE."""
+    if not RESULT_CACHE:
+        return read()
+    key, cached = RESULT_CACHE.lookup(sql_identity(), database, tables, sql, params)
+    if cached is not None:
+        return cached[0]
+    value = read()
+    RESULT_CACHE.store(key, (value,))
+    return value
+
+
+def table_written(database=None, table=None, keys=None):
+    """cache: drop cached data derived from database.table (everything if unknown).
+
+    keys, when given, are the primary keys of the rows written.
+    """
+    if RESULT_CACHE:
+        RESULT_CACHE.invalidate(database, table)
+
+    if database is None:
+        RFID_INDEX.invalidate()
+        GOOGLE_USER_INDEX.invalidate()
+        PHOTO_CACHE.invalidate()
+        return
+
+    if table == 'user_rfid':
+        RFID_INDEX.invalidate(lambda key: key[1] == database)
+
+    if table == 'google_users':
+        GOOGLE_USER_INDEX.invalidate(lambda key: key[1] == database)
+
+    if table == 'google_user_photos' and keys is not None:
+        keys = set(keys)
+        PHOTO_CACHE.invalidate(lambda key, value: key[1] == database and value[0] in keys)
+    elif table in ['google_users', 'google_user_photos']:
+        PHOTO_CACHE.invalidate(lambda key, value: key[1] == database)
+
+
 def base64_untoken(base64_bytes):
     """base64: untoken."""
     token_bytes = base64.b64decode(base64_bytes)
@@ -890,10 +2080,87 @@ def fetchall(sql):
     """sql: fetchall."""
     cnx = sql_connection()
     cur = cnx.cursor(buffered=True)
-    cur.execute(sql)
-    rows = cur.fetchall()
-    cur.close()
+    try:
+        cur.execute(sql)
+        return cur.fetchall()
+    finally:
+        cur.close()
+        cnx.close()
+
+
+def fetchiter(sql, params=None, size=STREAM_BATCH):
+    """sql: fetch rows in batches from an unbuffered cursor.
+
+    Returns a generator of row lists; the connection is held until the
+    generator is exhausted or closed.
+    """
+    return fetchiter_described(sql, params, size)[1]
+
+
+def fetchiter_described(sql, params=None, size=STREAM_BATCH):
+    """sql: (cursor.description, generator of row lists), as fetchiter."""
+    cnx = sql_connection()
+    cur = cnx.cursor(buffered=False)
+    try:
+        cur.execute(sql, params)
+    except Exception:
+        close_unbuffered(cur, cnx)
+        raise
+
+    def batches():
+        try:
+            while True:
+                rows = cur.fetchmany(size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            close_unbuffered(cur, cnx)
+
+    return cur.description, batches()
+
+
+def close_unbuffered(cur, cnx):
+    """sql: close an unbuffered cursor that may still have unread rows."""
+    try:
+        cur.close()
+    except Exception:  # pylint: disable=broad-except
+        # Unread result; the pool discards the connection on close.
+        pass
     cnx.close()
+
+
+def fetchall_params(sql, params):
+    """sql: fetchall with params."""
+    cnx = sql_connection()
+    cur = cnx.cursor(buffered=True)
+    try:
+        cur.execute(sql, params)
+        return cur.fetchall()
+    finally:
+        cur.close()
+        cnx.close()
+
+
+def fetchall_dicts(sql, params):
+    """sql: fetchall with params, rows as {column: value}."""
+    cnx = sql_connection()
+    cur = cnx.cursor(buffered=True, dictionary=True)
+    try:
+        cur.execute(sql, params)
+        return cur.fetchall()
+    finally:
+        cur.close()
+        cnx.close()
+
+
+def fetchall_schema(sql):
+    """sql: fetchall through the schema metadata cache."""
+    key = (sql_identity(), sql)
+    rows = SCHEMA_CACHE.get(key)
+    if rows is None:
+        rows = fetchall(sql)
+        SCHEMA_CACHE.set(key, rows)
     return rows
 
 
@@ -901,140 +2168,264 @@ def fetchone(sql):
     """sql: fetchone."""
     cnx = sql_connection()
     cur = cnx.cursor(buffered=True)
-    cur.execute(sql)
-    row = cur.fetchone()
-    cur.close()
-    cnx.close()
-    return row
+    try:
+        cur.execute(sql)
+        return cur.fetchone()
+    finally:
+        cur.close()
+        cnx.close()
 
 
 def fetchone_params(sql, params):
     """sql: fetchone with params."""
     cnx = sql_connection()
     cur = cnx.cursor(buffered=True)
-    cur.execute(sql, params)
-    row = cur.fetchone()
-    cur.close()
-    cnx.close()
-    return row
+    try:
+        cur.execute(sql, params)
+        return cur.fetchone()
+    finally:
+        cur.close()
+        cnx.close()
+
+
+def fetchone_prepared(sql, params):
+    """sql: fetchone with params as a (cached) server-side prepared statement."""
+    if not PREPARED:
+        return fetchone_params(sql, params)
+    cnx = sql_connection()
+    try:
+        rows = pool.execute_prepared(cnx, sql, params)[0]
+        return rows[0] if rows else None
+    finally:
+        cnx.close()
+
+
+def sqlexec_prepared(sql, values):
+    """sql: exec values as a (cached) server-side prepared statement."""
+    if not PREPARED:
+        return sqlexec(sql, values)
+    cnx = sql_connection()
+    try:
+        rowid = pool.execute_prepared(cnx, sql, values)[1]
+        cnx.commit()
+        return rowid
+    finally:
+        cnx.close()
 
 
 def sqlexec(sql, values):
     """sql: exec values."""
     cnx = sql_connection()
     cur = cnx.cursor(buffered=True)
-    cur.execute(sql, values)
-    cnx.commit()
-    lastrowid = cur.lastrowid
-    cur.close()
-    cnx.close()
-    return lastrowid
+    try:
+        cur.execute(sql, values)
+        cnx.commit()
+        return cur.lastrowid
+    finally:
+        cur.close()
+        cnx.close()
+
+
+def sqlexecmany(sql, records, batch):
+    """sql: executemany records in batches inside one transaction.
+
+    Returns [{rowcount, firstrowid, lastrowid}] per batch. For a
+    multi-row INSERT MySQL reports the first generated id; the batch's
+    ids are consecutive under the default innodb_autoinc_lock_mode.
+    """
+    cnx = sql_connection()
+    cur = cnx.cursor(buffered=True)
+    results = []
+    try:
+        for start in range(0, len(records), batch):
+            cur.executemany(sql, records[start:start + batch])
+            first = cur.lastrowid or None
+            results.append({'rowcount': cur.rowcount,
+                            'firstrowid': first,
+                            'lastrowid': first + cur.rowcount - 1 if first else None})
+        cnx.commit()
+        return results
+    except Exception:
+        cnx.rollback()
+        raise
+    finally:
+        cur.close()
+        cnx.close()
 
 
 def sqlcommit(sql):
     """sql: commit."""
     cnx = sql_connection()
     cur = cnx.cursor(buffered=True)
-    cur.execute(sql)
-    cnx.commit()
-    rowcount = cur.rowcount
-    cur.close()
-    cnx.close()
-    return rowcount
+    try:
+        cur.execute(sql)
+        cnx.commit()
+        return cur.rowcount
+    finally:
+        cur.close()
+        cnx.close()
 
 
 def sqlinsert(sql, values, user, password):
     """sql: insert values, user, password."""
     cnx = sql_connection(user, password)
     cur = cnx.cursor(buffered=True)
-    cur.execute(sql, values)
-    cnx.commit()
-    lastrowid = cur.lastrowid
-    cur.close()
-    cnx.close()
-    return lastrowid
+    try:
+        cur.execute(sql, values)
+        cnx.commit()
+        return cur.lastrowid
+    finally:
+        cur.close()
+        cnx.close()
 
 
-def sql_connection(user=None, password=None):
-    """sql: connection."""
+def sql_config(user=None, password=None):
+    """sql: connection config from request credentials and X- headers."""
     if not user:
         user = request.authorization.username
 
     if not password:
         password = request.authorization.password
 
+    return headers_config(request.headers, user, password)
+
+
+def headers_config(headers, user, password):
+    """sql: connection config for user/password from X- headers (werkzeug Headers)."""
     config = {
         'user':                   user,
         'password':               password,
-        'host':                   request.headers.get('X-Host', '127.0.0.1'),
-        'port':               int(request.headers.get('X-Port', '3306')),
-        'database':               request.headers.get('X-Db', ''),
-        'raise_on_warnings':      request.headers.get('X-Raise-Warnings', True),
-        'get_warnings':           request.headers.get('X-Get-Warnings', True),
-        'auth_plugin':            request.headers.get('X-Auth-Plugin', 'mysql_native_password'),
-        'use_pure':               request.headers.get('X-Pure', True),
-        'use_unicode':            request.headers.get('X-Unicode', True),
-        'charset':                request.headers.get('X-Charset', 'utf8'),
-        'connection_timeout': int(request.headers.get('X-Connection-Timeout', 10)),
+        'host':                   headers.get('X-Host', '127.0.0.1'),
+        'port':               int(headers.get('X-Port', '3306')),
+        'database':               headers.get('X-Db', ''),
+        'raise_on_warnings':      headers.get('X-Raise-Warnings', True),
+        'get_warnings':           headers.get('X-Get-Warnings', True),
+        'auth_plugin':            headers.get('X-Auth-Plugin', 'mysql_native_password'),
+        'use_pure':               headers.get('X-Pure', True),
+        'use_unicode':            headers.get('X-Unicode', True),
+        'charset':                headers.get('X-Charset', 'utf8'),
+        'connection_timeout': int(headers.get('X-Connection-Timeout', 10)),
     }
-    _db = mysql.connector.connect(**config)
+    return config
+
+
+def sql_identity(user=None, password=None):
+    """sql: hashable identity of the connection target and credentials."""
+    return pool.pool_key(sql_config(user, password))
+
+
+def check_credentials():
+    """sql: raise unless the request's credentials can open a connection."""
+    sql_connection().close()
+
+
+def sql_connection(user=None, password=None):
+    """sql: connection, checked out of the per-credential pool."""
+    _db = pool.connect(sql_config(user, password))
     return _db
 
 
-def sync_user_to_db(database, user):
-    """Sync Google user data to database.
+def user_row(user):
+    """Google user dict -> google_users column values (without id)."""
+    # Parse last login time
+    last_login = None
+    if user.get('lastLoginTime'):
+        try:
+            # Google format: 2023-11-27T10:30:00.000Z
+            last_login = datetime.fromisoformat(
+                user['lastLoginTime'].replace('Z', '+00:00')
+            )
+        except (ValueError, AttributeError):
+            pass
+
+    return (
+        user.get('primaryEmail'),
+        user.get('givenName'),
+        user.get('familyName'),
+        user.get('externalId'),
+        user.get('department'),
+        user.get('orgDescription'),
+        user.get('suspended', False),
+        user.get('isAdmin', False),
+        last_login
+    )
+
+
+def user_hash(user):
+    """Content hash of a Google user dict, stored in google_users.content_hash."""
+    data = json.dumps(user, sort_keys=True, default=str, separators=(',', ':'))
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+def sync_users_to_db(database, users):
+    """Sync Google users to database, writing only what changed.
+    
+    Stored content hashes are loaded in one query and compared with the
+    directory: removed users are deleted, changed users updated in place
+    (no REPLACE, so photos are not cascaded away) and new users inserted
+    with multi-row INSERTs, all in one transaction.
     
     Args:
         database: Database name
-        user: User dictionary from Google API
+        users: List of user dictionaries from Google API
         
     Returns:
-        Boolean indicating success
+        Tuple of (inserted, updated, deleted) counts
     """
+    stored = dict(fetchall("SELECT id, content_hash FROM " + database + ".google_users"))
+
+    inserts = []
+    updates = []
+    seen = set()
+    for user in users:
+        user_id = user.get('id')
+        seen.add(user_id)
+        content_hash = user_hash(user)
+        if user_id not in stored:
+            inserts.append((user_id,) + user_row(user) + (content_hash,))
+        elif stored[user_id] != content_hash:
+            updates.append(user_row(user) + (content_hash, user_id))
+
+    # An empty directory listing is far more likely an error than a purge.
+    deletes = [user_id for user_id in stored if user_id not in seen] if users else []
+
+    if not (inserts or updates or deletes):
+        return 0, 0, 0
+
+    cnx = sql_connection()
+    cur = cnx.cursor(buffered=True)
     try:
-        cnx = sql_connection()
-        cur = cnx.cursor(buffered=True)
-        
-        # Parse last login time
-        last_login = None
-        if user.get('lastLoginTime'):
-            try:
-                # Google format: 2023-11-27T10:30:00.000Z
-                last_login = datetime.fromisoformat(
-                    user['lastLoginTime'].replace('Z', '+00:00')
-                )
-            except (ValueError, AttributeError):
-                pass
-        
-        sql = (
-            "REPLACE INTO " + database + ".google_users "
-            "(id, primary_email, given_name, family_name, external_id, "
-            "department, org_description, suspended, is_admin, last_login_time) "
-            "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"
-        )
-        
-        values = (
-            user.get('id'),
-            user.get('primaryEmail'),
-            user.get('givenName'),
-            user.get('familyName'),
-            user.get('externalId'),
-            user.get('department'),
-            user.get('orgDescription'),
-            user.get('suspended', False),
-            user.get('isAdmin', False),
-            last_login
-        )
-        
-        cur.execute(sql, values)
+        for start in range(0, len(deletes), USER_SYNC_BATCH):
+            batch = deletes[start:start + USER_SYNC_BATCH]
+            cur.execute("DELETE FROM " + database + ".google_users WHERE id IN (" +
+                        ",".join(['%s'] * len(batch)) + ")", batch)
+
+        if updates:
+            cur.executemany(
+                "UPDATE " + database + ".google_users "
+                "SET primary_email=%s, given_name=%s, family_name=%s, external_id=%s, "
+                "department=%s, org_description=%s, suspended=%s, is_admin=%s, "
+                "last_login_time=%s, content_hash=%s WHERE id=%s",
+                updates)
+
+        for start in range(0, len(inserts), USER_SYNC_BATCH):
+            cur.executemany(
+                "INSERT INTO " + database + ".google_users "
+                "(id, primary_email, given_name, family_name, external_id, "
+                "department, org_description, suspended, is_admin, last_login_time, content_hash) "
+                "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)",
+                inserts[start:start + USER_SYNC_BATCH])
+
         cnx.commit()
+    except Exception:
+        cnx.rollback()
+        raise
+    finally:
         cur.close()
         cnx.close()
-        return True
-        
-    except Exception as e:
-        print(f"Error syncing user {user.get('primaryEmail')}: {e}")
-        return False
+        table_written(database, 'google_users')
+
+    return len(inserts), len(updates), len(deletes)
 
 
 def sync_photo_to_db(database, user_id, photo_data, mime_type):
@@ -1049,24 +2440,153 @@ def sync_photo_to_db(database, user_id, photo_data, mime_type):
     Returns:
         Boolean indicating success
     """
+    return sync_photos_to_db(database, [(user_id, photo_data, mime_type)]) == 1
+
+
+def sync_photos_to_db(database, photos):
+    """Store many Google user photos with one multi-row REPLACE.
+
+    If the statement fails the photos are stored one by one, so a bad
+    row only loses itself.
+
+    Args:
+        database: Database name
+        photos: List of (user_id, photo_data, mime_type)
+
+    Returns:
+        Number of photos stored
+    """
+    try:
+        replace_photos(database, photos)
+        stored = photos
+    except Exception as e:
+        print(f"Error syncing {len(photos)} photos: {e}")
+        stored = []
+        if len(photos) > 1:
+            for photo in photos:
+                try:
+                    replace_photos(database, [photo])
+                    stored.append(photo)
+                except Exception as row_error:
+                    print(f"Error syncing photo of user {photo[0]}: {row_error}")
+
+    if stored:
+        table_written(database, 'google_user_photos', [photo[0] for photo in stored])
+    return len(stored)
+
+
+def replace_photos(database, photos):
+    """REPLACE photos (user_id, photo_data, mime_type) in one statement and commit."""
+    sql = (
+        "REPLACE INTO " + database + ".google_user_photos "
+        "(user_id, photo_data, mime_type, content_hash) VALUES " +
+        ",".join(["(%s, %s, %s, %s)"] * len(photos))
+    )
+    values = []
+    for user_id, photo_data, mime_type in photos:
+        values += [user_id, photo_data, mime_type, hashlib.sha256(photo_data).hexdigest()]
+
+    cnx = sql_connection()
+    cur = cnx.cursor(buffered=True)
+    try:
+        cur.execute(sql, values)
+        cnx.commit()
+    finally:
+        cur.close()
+        cnx.close()
+
+
+def fetch_photo_variant(database, user_id, source_hash, variant):
+    """Return a stored (photo_data, mime_type) variant rendered from source_hash, or None."""
+    sql = (
+        "SELECT photo_data, mime_type FROM " + database + ".google_user_photo_variants "
+        "WHERE user_id=%s AND size=%s AND format=%s AND source_hash=%s LIMIT 1"
+    )
+    try:
+        row = fetchone_params(sql, (user_id, variant[0], variant[1], source_hash))
+    except Exception as e:
+        # Variants table missing (not upgraded yet): render on every request
+        print(f"Error reading photo variant: {e}")
+        return None
+    if row and row[0]:
+        return bytes(row[0]), row[1]
+    return None
+
+
+def store_photo_variant(database, user_id, source_hash, variant, photo_data, mime_type):
+    """Store a rendered photo variant, replacing one made from an older photo.
+
+    Returns:
+        Boolean indicating success
+    """
+    sql = (
+        "REPLACE INTO " + database + ".google_user_photo_variants "
+        "(user_id, size, format, source_hash, photo_data, mime_type) "
+        "VALUES (%s, %s, %s, %s, %s, %s)"
+    )
+    try:
+        sqlexec(sql, (user_id, variant[0], variant[1], source_hash, photo_data, mime_type))
+        table_written(database, 'google_user_photo_variants')
+        return True
+    except Exception as e:
+        print(f"Error storing photo variant: {e}")
+        return False
+
+
+def acquire_sync_lock(database):
+    """Take database's sync lock (GET_LOCK) on a connection of its own.
+
+    The lock lives as long as that connection, so it is not taken from
+    the pool; close it with close_sync_lock() when the sync ends.
+
+    Returns:
+        The connection holding the lock, or None if another session holds it
+    """
+    cnx = mysql.connector.connect(**sql_config())
+    try:
+        cur = cnx.cursor(buffered=True)
+        cur.execute("SELECT GET_LOCK(%s, 0)", (("db-api-sync:" + database)[:64],))
+        held = cur.fetchone()[0] == 1
+        cur.close()
+    except Exception:
+        cnx.close()
+        raise
+    if not held:
+        cnx.close()
+        return None
+    return cnx
+
+
+def close_sync_lock(cnx):
+    """Release a sync lock by closing its connection."""
+    try:
+        cnx.close()
+    except Exception as e:  # pylint: disable=broad-except
+        print(f"Error releasing sync lock: {e}")
+
+
+def fail_stale_syncs(database):
+    """Mark 'started' sync log entries failed; call only while holding the sync lock."""
     try:
         cnx = sql_connection()
         cur = cnx.cursor(buffered=True)
-        
+
         sql = (
-            "REPLACE INTO " + database + ".google_user_photos "
-            "(user_id, photo_data, mime_type) VALUES (%s, %s, %s)"
+            "UPDATE " + database + ".google_sync_log "
+            "SET sync_status=%s, error_message=%s, completed_at=NOW() "
+            "WHERE sync_status=%s"
         )
-        
-        cur.execute(sql, (user_id, photo_data, mime_type))
+
+        cur.execute(sql, ('failed', "Interrupted before completion", 'started'))
         cnx.commit()
+        stale = cur.rowcount
         cur.close()
         cnx.close()
-        return True
-        
+        if stale:
+            table_written(database, 'google_sync_log')
+
     except Exception as e:
-        print(f"Error syncing photo for user {user_id}: {e}")
-        return False
+        print(f"Error failing stale syncs: {e}")
 
 
 def log_sync_start(database, sync_type):
@@ -1093,6 +2613,7 @@ def log_sync_start(database, sync_type):
         log_id = cur.lastrowid
         cur.close()
         cnx.close()
+        table_written(database, 'google_sync_log')
         return log_id
         
     except Exception as e:
@@ -1100,7 +2621,37 @@ def log_sync_start(database, sync_type):
         return None
 
 
-def log_sync_complete(database, log_id, users_synced, photos_synced):
+def log_sync_progress(database, log_id, users_synced, photos_synced):
+    """Record progress counters of a running sync operation.
+    
+    Args:
+        database: Database name
+        log_id: Log entry ID
+        users_synced: Number of users synced so far
+        photos_synced: Number of photos synced so far
+    """
+    try:
+        cnx = sql_connection()
+        cur = cnx.cursor(buffered=True)
+        try:
+            sql = (
+                "UPDATE " + database + ".google_sync_log "
+                "SET users_synced=%s, photos_synced=%s WHERE id=%s"
+            )
+            cur.execute(sql, (users_synced, photos_synced, log_id))
+            cnx.commit()
+        finally:
+            cur.close()
+            cnx.close()
+        table_written(database, 'google_sync_log')
+
+    except Exception as e:
+        print(f"Error logging sync progress: {e}")
+
+
+def log_sync_complete(database, log_id, users_synced, photos_synced,
+                      users_inserted=None, users_updated=None, users_deleted=None,
+                      photos_failed=None):
     """Log the completion of a sync operation.
     
     Args:
@@ -1108,6 +2659,10 @@ def log_sync_complete(database, log_id, users_synced, photos_synced):
         log_id: Log entry ID
         users_synced: Number of users synced
         photos_synced: Number of photos synced
+        users_inserted: Number of new users (user syncs only)
+        users_updated: Number of changed users (user syncs only)
+        users_deleted: Number of removed users (user syncs only)
+        photos_failed: Number of photos that could not be stored (photo syncs only)
     """
     try:
         cnx = sql_connection()
@@ -1116,13 +2671,25 @@ def log_sync_complete(database, log_id, users_synced, photos_synced):
         sql = (
             "UPDATE " + database + ".google_sync_log "
             "SET sync_status=%s, users_synced=%s, photos_synced=%s, "
-            "completed_at=NOW() WHERE id=%s"
         )
+        values = ['completed', users_synced, photos_synced]
+
+        if users_inserted is not None:
+            sql += "users_inserted=%s, users_updated=%s, users_deleted=%s, "
+            values += [users_inserted, users_updated, users_deleted]
+
+        if photos_failed is not None:
+            sql += "photos_failed=%s, "
+            values.append(photos_failed)
+
+        sql += "completed_at=NOW() WHERE id=%s"
+        values.append(log_id)
         
-        cur.execute(sql, ('completed', users_synced, photos_synced, log_id))
+        cur.execute(sql, values)
         cnx.commit()
         cur.close()
         cnx.close()
+        table_written(database, 'google_sync_log')
         
     except Exception as e:
         print(f"Error logging sync completion: {e}")
@@ -1150,11 +2717,29 @@ def log_sync_failed(database, log_id, error_message):
         cnx.commit()
         cur.close()
         cnx.close()
+        table_written(database, 'google_sync_log')
         
     except Exception as e:
         print(f"Error logging sync failure: {e}")
 
 
+def transient_error(e):
+    """True if e may not happen again: lost connection, lock wait timeout, deadlock, full pool."""
+    if isinstance(e, (mysql.connector.InterfaceError, mysql.connector.PoolError)):
+        return True
+    return isinstance(e, mysql.connector.Error) and e.errno in TRANSIENT_ERRNOS
+
+
+ATTENDANCE_QUEUE = writebehind.WriteBehind(
+    flush_attendance,
+    max_rows=int(os.environ.get('DB_API_ATTENDANCE_BATCH', '500')),
+    interval=float(os.environ.get('DB_API_ATTENDANCE_FLUSH_MS', '200')) / 1000,
+    maxsize=int(os.environ.get('DB_API_ATTENDANCE_QUEUE', '10000')),
+    transient=transient_error,
+    retries=int(os.environ.get('DB_API_ATTENDANCE_RETRIES', '3')))
+atexit.register(ATTENDANCE_QUEUE.close)
+
+
 def main():
     """main: app."""
     APP.run(port=8980, debug=False)
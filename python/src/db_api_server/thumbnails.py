@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+
+"""thumbnails: resized / re-encoded photo variants (requires Pillow)."""
+
+import os
+from io import BytesIO
+
+try:
+    from PIL import Image
+    AVAILABLE = True
+except ImportError:
+    Image = None
+    AVAILABLE = False
+
+
+SIZES = (64, 128, 256)
+JPEG_QUALITY = int(os.environ.get('DB_API_THUMBNAIL_JPEG_QUALITY', '85'))
+WEBP_QUALITY = int(os.environ.get('DB_API_THUMBNAIL_WEBP_QUALITY', '80'))
+
+
+def render(data, size=0, fmt='native'):
+    """Scale image bytes to fit in size x size pixels and re-encode them.
+
+    Args:
+        data: Source image bytes
+        size: Bounding box in pixels; 0 keeps the source dimensions
+        fmt: 'webp', or 'native' to keep the source format (GIF etc. become PNG)
+
+    Returns:
+        Tuple of (image bytes, MIME type)
+    """
+    with Image.open(BytesIO(data)) as img:
+        if fmt == 'webp':
+            out_format = 'WEBP'
+        elif img.format in ('JPEG', 'PNG', 'WEBP'):
+            out_format = img.format
+        else:
+            out_format = 'PNG'
+
+        if size:
+            # Never upscales; keeps the aspect ratio
+            img.thumbnail((size, size), Image.LANCZOS)
+        else:
+            img.load()
+
+        if out_format == 'JPEG':
+            options = {'quality': JPEG_QUALITY, 'optimize': True}
+            if img.mode not in ('RGB', 'L'):
+                img = img.convert('RGB')
+        elif out_format == 'WEBP':
+            options = {'quality': WEBP_QUALITY, 'method': 4}
+            if img.mode not in ('RGB', 'RGBA'):
+                alpha = img.mode in ('LA', 'PA') or 'transparency' in img.info
+                img = img.convert('RGBA' if alpha else 'RGB')
+        else:
+            options = {'optimize': True}
+
+        out = BytesIO()
+        img.save(out, out_format, **options)
+
+    return out.getvalue(), 'image/' + out_format.lower()
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+
+"""txbatch: ordered insert/replace/update/delete operations for one transaction.
+
+    {"operations": [
+        {"op": "insert", "table": "orders", "values": {"customer": 7}},
+        {"op": "insert", "table": "order_lines", "values": {"order_id": {"$ref": 0}, "sku": "A1"}},
+        {"op": "update", "table": "customers", "key": 7, "values": {"status": "active"}},
+        {"op": "delete", "table": "carts", "key": 7, "column": "customer"}],
+     "savepoints": false}
+
+A bare array is the operations list. update/delete match key against
+column (default id). {"$ref": N} stands for the id generated by earlier
+operation N. Without savepoints the first failure aborts the batch; with
+savepoints each operation runs under its own SAVEPOINT, so a failure
+undoes only that operation and the others still commit.
+"""
+
+import re
+
+import mysql.connector
+
+from .query import quote
+
+OPS = ('insert', 'replace', 'update', 'delete')
+TABLE_RE = re.compile(r'^[A-Za-z0-9_$]+$')
+_SCALARS = (str, int, float, bool, type(None))
+
+
+class BatchError(ValueError):
+    """Malformed batch, operation or reference."""
+
+
+class Failed(Exception):
+    """Operation index failed with error; the batch must be rolled back."""
+
+    def __init__(self, index, error):
+        super().__init__("operation %d: %s" % (index, error))
+        self.index = index
+        self.error = error
+
+
+class Ref:
+    """Placeholder for the id generated by operation index."""
+
+    def __init__(self, index):
+        self.index = index
+
+
+class Operation:
+    """One compiled operation: SQL plus parameters, some of them references."""
+
+    def __init__(self, op, table, sql, params):
+        """Initialize operation.
+
+        Args:
+            op: One of OPS
+            table: Table name
+            sql: Statement with %s placeholders
+            params: Parameter values; a Ref is resolved at run time
+        """
+        self.op = op
+        self.table = table
+        self.sql = sql
+        self.params = params
+
+    def bind(self, results):
+        """Parameters with references replaced by earlier results' ids."""
+        params = []
+        for value in self.params:
+            if isinstance(value, Ref):
+                rowid = results[value.index].get('rowid')
+                if rowid is None:
+                    raise BatchError("operation %d produced no id" % value.index)
+                value = rowid
+            params.append(value)
+        return params
+
+
+def _value(value, index, where):
+    """Validate a parameter value of operation index; {"$ref": N} -> Ref."""
+    if isinstance(value, dict):
+        ref = value.get('$ref')
+        if len(value) != 1 or not isinstance(ref, int) or isinstance(ref, bool):
+            raise BatchError("operation %d: %s must be a scalar or {\"$ref\": N}" % (index, where))
+        if not 0 <= ref < index:
+            raise BatchError("operation %d: $ref must name an earlier operation" % index)
+        return Ref(ref)
+    if not isinstance(value, _SCALARS):
+        raise BatchError("operation %d: %s must be a scalar or {\"$ref\": N}" % (index, where))
+    return value
+
+
+def _column(name, columns, index):
+    """Canonical column name (case-insensitive) or BatchError."""
+    column = columns.get(str(name).lower())
+    if column is None:
+        raise BatchError("operation %d: unknown column %s" % (index, name))
+    return column
+
+
+def compile_operation(database, operation, index, columns_of):
+    """Validate one operation dict and compile it to an Operation.
+
+    columns_of(table) returns the table's column names ([] if no such table).
+    """
+    if not isinstance(operation, dict):
+        raise BatchError("operation %d must be an object" % index)
+
+    op = str(operation.get('op', '')).lower()
+    if op not in OPS:
+        raise BatchError("operation %d: op must be one of %s" % (index, ", ".join(OPS)))
+
+    table = operation.get('table')
+    if not isinstance(table, str) or not TABLE_RE.match(table):
+        raise BatchError("operation %d: table is required" % index)
+    names = columns_of(table)
+    if not names:
+        raise BatchError("operation %d: unknown table %s" % (index, table))
+    columns = {name.lower(): name for name in names}
+    source = database + "." + table
+
+    values = operation.get('values')
+    if op == 'delete':
+        values = {}
+    elif not isinstance(values, dict) or not values:
+        raise BatchError("operation %d: values must be a non-empty object" % index)
+
+    fields = [quote(_column(name, columns, index)) for name in values]
+    params = [_value(value, index, name) for name, value in values.items()]
+
+    if op in ('insert', 'replace'):
+        sql = (op.upper() + " INTO " + source + " (" + ",".join(fields) + ") VALUES (" +
+               ",".join(['%s'] * len(fields)) + ")")
+        return Operation(op, table, sql, params)
+
+    if 'key' not in operation:
+        raise BatchError("operation %d: key is required" % index)
+    where = " WHERE " + quote(_column(operation.get('column', 'id'), columns, index)) + "=%s"
+    params.append(_value(operation['key'], index, 'key'))
+
+    if op == 'update':
+        sql = "UPDATE " + source + " SET " + ",".join(field + "=%s" for field in fields) + where
+    else:
+        sql = "DELETE FROM " + source + where
+    return Operation(op, table, sql, params)
+
+
+def parse(database, body, columns_of, max_operations):
+    """Request body -> (operations, savepoints); raises BatchError."""
+    savepoints = False
+    if isinstance(body, dict):
+        savepoints = body.get('savepoints', False)
+        if not isinstance(savepoints, bool):
+            raise BatchError("savepoints must be true or false")
+        body = body.get('operations')
+
+    if not isinstance(body, list) or not body:
+        raise BatchError("Expected a non-empty list of operations")
+    if len(body) > max_operations:
+        raise BatchError("At most %d operations per batch" % max_operations)
+
+    return [compile_operation(database, operation, index, columns_of)
+            for index, operation in enumerate(body)], savepoints
+
+
+def run(cur, operations, savepoints=False):
+    """Execute operations with cur; the caller commits or rolls back.
+
+    Returns one result dict per operation. Without savepoints the first
+    error raises Failed; with them the failed operation is rolled back
+    to its savepoint and reported in its result.
+    """
+    results = []
+    for index, operation in enumerate(operations):
+        result = {'op': operation.op, 'table': operation.table}
+        if savepoints:
+            cur.execute("SAVEPOINT batch_%d" % index)
+        try:
+            cur.execute(operation.sql, operation.bind(results))
+            result['rowcount'] = cur.rowcount
+            if operation.op in ('insert', 'replace'):
+                result['rowid'] = cur.lastrowid or None
+            if savepoints:
+                cur.execute("RELEASE SAVEPOINT batch_%d" % index)
+        except (mysql.connector.Error, BatchError) as e:
+            if not savepoints:
+                raise Failed(index, e) from e
+            cur.execute("ROLLBACK TO SAVEPOINT batch_%d" % index)
+            result['error'] = str(e)
+        results.append(result)
+    return results
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+"""upsert: batched INSERT ... ON DUPLICATE KEY UPDATE with per-row outcome counts.
+
+MySQL reports 1 affected row per inserted row and 2 per updated row
+(0 when the update changed nothing, 1 with CLIENT_FOUND_ROWS), and for a
+multi-row statement the OK packet's info message adds "Records: R
+Duplicates: D". D counts the updated rows (every duplicate key with
+CLIENT_FOUND_ROWS). Together they give inserted, updated and unchanged
+counts per batch.
+"""
+
+import re
+
+from mysql.connector.constants import ClientFlag
+from mysql.connector.cursor import MySQLCursor
+
+from .query import quote
+
+INFO_RE = re.compile(r'Records:\s*(\d+)\s+Duplicates:\s*(\d+)')
+VERSION_RE = re.compile(r'^(\d+)\.(\d+)\.(\d+)')
+
+
+class InfoCursor(MySQLCursor):
+    """Cursor keeping the info message of the last OK packet."""
+
+    info = None
+
+    def _handle_noresultset(self, res):
+        """Remember res's info_msg, then handle res as usual."""
+        self.info = res.get('info_msg') if isinstance(res, dict) else None
+        super()._handle_noresultset(res)
+
+
+def row_alias(server_info):
+    """True if the server takes INSERT ... AS new (MySQL 8.0.19+, not MariaDB).
+
+    VALUES(col) in ON DUPLICATE KEY UPDATE is deprecated from MySQL 8.0.20
+    (a warning, an error with raise_on_warnings); MariaDB only has VALUES().
+    """
+    info = server_info or ''
+    match = VERSION_RE.match(info)
+    if 'mariadb' in info.lower() or not match:
+        return False
+    return tuple(int(part) for part in match.groups()) >= (8, 0, 19)
+
+
+def statement(source, columns, update, rows, server_info):
+    """INSERT of rows (a count) into source with update columns taken from the new row."""
+    fields = [quote(column) for column in columns]
+    sql = ("INSERT INTO " + source + " (" + ",".join(fields) + ") VALUES " +
+           ",".join(["(" + ",".join(['%s'] * len(fields)) + ")"] * rows))
+
+    if not update:
+        # Keep existing rows as they are: a no-op update instead of INSERT IGNORE,
+        # which would also swallow unrelated errors.
+        return sql + " ON DUPLICATE KEY UPDATE " + fields[0] + "=" + fields[0]
+    if row_alias(server_info):
+        return sql + " AS new ON DUPLICATE KEY UPDATE " + ",".join(
+            quote(column) + "=new." + quote(column) for column in update)
+    return sql + " ON DUPLICATE KEY UPDATE " + ",".join(
+        quote(column) + "=VALUES(" + quote(column) + ")" for column in update)
+
+
+def counts(rows, affected, info, found_rows=False):
+    """(inserted, updated, unchanged) for a statement of rows rows, or None if unknown.
+
+    found_rows: the connection set CLIENT_FOUND_ROWS (unchanged rows count 1, not 0)
+    """
+    match = INFO_RE.search(info or '')
+    if match:
+        records, duplicates = int(match.group(1)), int(match.group(2))
+    elif rows == 1 and not found_rows:
+        # No info message for a single row: 1 inserted, 2 updated, 0 unchanged
+        records, duplicates = 1, 1 if affected == 2 else 0
+    else:
+        return None
+
+    if found_rows:
+        # affected = inserted + 2 * updated + unchanged; duplicates = updated + unchanged
+        updated = affected - records
+        inserted = records - duplicates
+    else:
+        # affected = inserted + 2 * updated; duplicates = updated
+        updated = duplicates
+        inserted = affected - 2 * duplicates
+    return inserted, updated, records - inserted - updated
+
+
+def run(cnx, cur, source, columns, update, records, batch):
+    """Upsert records (value tuples) batch rows per statement; the caller commits.
+
+    Returns [{rowcount, inserted, updated, unchanged}] per batch; the
+    counts are None when the cursor can not see the info message (the C
+    extension).
+    """
+    server_info = cnx.get_server_info()
+    found_rows = cnx.isset_client_flag(ClientFlag.FOUND_ROWS)
+    results = []
+    for start in range(0, len(records), batch):
+        chunk = records[start:start + batch]
+        cur.execute(statement(source, columns, update, len(chunk), server_info),
+                    [value for record in chunk for value in record])
+        outcome = counts(len(chunk), cur.rowcount, getattr(cur, 'info', None), found_rows)
+        inserted, updated, unchanged = outcome or (None, None, None)
+        results.append({'rowcount': len(chunk),
+                        'inserted': inserted,
+                        'updated': updated,
+                        'unchanged': unchanged})
+    return results
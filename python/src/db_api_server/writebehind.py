@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+
+"""writebehind: bounded in-process queue flushed in batches by a background thread."""
+
+import os
+import queue
+import threading
+import time
+
+
+class Ticket:
+    """Handle for one queued row; completed when its batch is written."""
+
+    def __init__(self):
+        """Initialize ticket."""
+        self.rowid = None
+        self.error = None
+        self.attempts = 0
+        self._done = threading.Event()
+
+    def done(self, rowid=None, error=None):
+        """Mark the row written (or failed)."""
+        self.rowid = rowid
+        self.error = error
+        self._done.set()
+
+    def wait(self, timeout=None):
+        """Block until the row is written; False on timeout."""
+        return self._done.wait(timeout)
+
+
+class WriteBehind:
+    """Queue of rows written by flush(config, key, rows) in batches.
+
+    Rows are grouped by key; a batch is flushed when max_rows rows are
+    waiting or interval seconds after its first row arrived. flush must
+    return the insert id of the first row (or None). A batch failing
+    with a transient error is requeued and retried after a backoff; any
+    other error makes each of its rows be flushed alone, so only the
+    rows at fault fail.
+    """
+
+    def __init__(self, flush, max_rows=500, interval=0.2, maxsize=10000,
+                 transient=None, retries=3, backoff=0.5):
+        """Initialize queue.
+
+        Args:
+            flush: Callable(config, key, rows) writing rows, returning the first insert id
+            max_rows: Rows per flush
+            interval: Seconds a row may wait before its batch is flushed
+            maxsize: Queued rows before submit() applies backpressure
+            transient: Callable(error) -> True if flushing again may succeed
+            retries: Times a batch is retried after a transient error
+            backoff: Seconds before the first retry, doubled for each next one
+        """
+        self.flush = flush
+        self.max_rows = max_rows
+        self.interval = interval
+        self.maxsize = maxsize
+        self.transient = transient or (lambda e: False)
+        self.retries = retries
+        self.backoff = backoff
+        self.flushed = 0
+        self.failed = 0
+        self.retried = 0
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def _start(self):
+        """Start the flusher thread in this process (again after a fork)."""
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(self.maxsize)
+            self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+            self._pid = os.getpid()
+            self._closed = False
+            self._thread.start()
+
+    def submit(self, config, key, row, timeout=0.5):
+        """Queue row; raises queue.Full if the queue stays full for timeout seconds."""
+        self._start()
+        if self._closed:
+            raise queue.Full("write-behind queue is closed")
+        ticket = Ticket()
+        self._queue.put((config, key, row, ticket), timeout=timeout)
+        return ticket
+
+    def _run(self):
+        """Flusher loop."""
+        items = []
+        deadline = None
+        retry = []
+        retry_at = None
+        while True:
+            wake = min([t for t in (deadline, retry_at) if t is not None], default=None)
+            timeout = None if wake is None else max(0.0, wake - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = False
+
+            if item is None:
+                retry = self._write(retry + items)
+                while retry:
+                    time.sleep(self._delay(retry))
+                    retry = self._write(retry)
+                return
+
+            if item:
+                items.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.interval
+
+            now = time.monotonic()
+            if retry and now >= retry_at:
+                items = retry + items
+                retry = []
+                retry_at = None
+                deadline = now
+
+            if items and (len(items) >= self.max_rows or now >= deadline):
+                retry += self._write(items)
+                if retry and retry_at is None:
+                    retry_at = now + self._delay(retry)
+                items = []
+                deadline = None
+
+    def _delay(self, items):
+        """Backoff before the next attempt at items."""
+        return self.backoff * 2 ** (max(item[3].attempts for item in items) - 1)
+
+    def _write(self, items):
+        """Flush items, one batch per key; return the items to retry."""
+        groups = {}
+        for item in items:
+            groups.setdefault(item[1], []).append(item)
+
+        retry = []
+        for key, group in groups.items():
+            try:
+                first = self.flush(group[0][0], key, [item[2] for item in group])
+            except Exception as e:  # pylint: disable=broad-except
+                if self.transient(e):
+                    for item in group:
+                        item[3].attempts += 1
+                    again = [item for item in group if item[3].attempts <= self.retries]
+                    if again:
+                        print(f"Retrying {len(again)} queued rows for {key[-1]}: {e}")
+                        self.retried += len(again)
+                        retry.extend(again)
+                    if len(again) < len(group):
+                        self._fail(key, [item for item in group if item[3].attempts > self.retries], e)
+                elif len(group) > 1:
+                    print(f"Error flushing {len(group)} queued rows for {key[-1]}, "
+                          f"writing them one by one: {e}")
+                    for item in group:
+                        self._write_one(key, item)
+                else:
+                    self._fail(key, group, e)
+                continue
+
+            self.flushed += len(group)
+            for offset, item in enumerate(group):
+                item[3].done(rowid=first + offset if first else None)
+        return retry
+
+    def _write_one(self, key, item):
+        """Flush a single row."""
+        try:
+            rowid = self.flush(item[0], key, [item[2]])
+        except Exception as e:  # pylint: disable=broad-except
+            self._fail(key, [item], e)
+            return
+        self.flushed += 1
+        item[3].done(rowid=rowid)
+
+    def _fail(self, key, group, e):
+        """Give up on the rows of group."""
+        print(f"Error flushing {len(group)} queued rows for {key[-1]}: {e}")
+        self.failed += len(group)
+        for item in group:
+            item[3].done(error=str(e))
+
+    def close(self, timeout=10.0):
+        """Stop accepting rows and flush everything queued."""
+        with self._lock:
+            if self._pid != os.getpid() or self._closed:
+                return
+            self._closed = True
+        deadline = time.monotonic() + timeout
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            print(f"Write-behind queue still full after {timeout}s; queued rows are lost")
+            return
+        self._thread.join(max(0.0, deadline - time.monotonic()))
+
+    def stats(self):
+        """Return queue depth and counters."""
+        return {'queued': self._queue.qsize() if self._pid == os.getpid() else 0,
+                'maxsize': self.maxsize,
+                'flushed': self.flushed,
+                'retried': self.retried,
+                'failed': self.failed}
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+# Benchmark: response JSON encoding, legacy AppJSONEncoder vs fastjson.
+#   cd python/tests && python3 bench.json.py [rows]
+
+import decimal
+import json
+import os
+import sys
+import timeit
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from werkzeug.http import http_date  # noqa: E402
+
+from db_api_server import fastjson  # noqa: E402
+
+
+class LegacyJSONEncoder(json.JSONEncoder):
+    """AppJSONEncoder as it was, plus Flask's HTTP dates."""
+
+    def default(self, o):
+        if isinstance(o, decimal.Decimal):
+            return str(o)
+        if isinstance(o, bytes):
+            try:
+                o = o.decode('utf-8')
+                try:
+                    return json.loads(o)
+                except json.decoder.JSONDecodeError:
+                    return str(o)
+            except UnicodeDecodeError:
+                return str(o)
+        if isinstance(o, datetime):
+            return http_date(o)
+        return super().default(o)
+
+
+count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+# A wide-ish row: ids, text, money, timestamps, a JSON column, a text blob, NULLs
+rows = [(i, 'user%d@example.com' % i, 'Given', 'Family', decimal.Decimal('%d.25' % i),
+         datetime(2025, 11, 27, 10, 30, i % 60), b'{"door": "main", "count": 3}',
+         b'badge notes', i % 2 == 0, None, 3.5, 'Department %d' % (i % 10))
+        for i in range(count)]
+
+assert json.loads(fastjson.dumps(rows)) == json.loads(json.dumps(rows, cls=LegacyJSONEncoder))
+
+cases = [('legacy json, pretty', lambda: json.dumps(rows, cls=LegacyJSONEncoder, indent=2)),
+         ('legacy json, compact', lambda: json.dumps(rows, cls=LegacyJSONEncoder, separators=(',', ':')))]
+
+
+def fast(use_orjson):
+    """fastjson.dumps with the given backend."""
+    fastjson.USE_ORJSON = use_orjson
+    return fastjson.dumps(rows)
+
+
+cases.append(('fastjson json', lambda: fast(False)))
+if fastjson.orjson is not None:
+    cases.append(('fastjson orjson', lambda: fast(True)))
+
+print('%d rows x %d columns' % (count, len(rows[0])))
+base = None
+for name, func in cases:
+    best = min(timeit.repeat(func, number=1, repeat=5))
+    base = base or best
+    print('%-22s %8.1f ms  %5.1fx' % (name, best * 1000, base / best))
@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+
+# Check: upsert.counts() arithmetic for the info messages MySQL sends.
+#   cd python/tests && python3 check.upsert.py
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from db_api_server.upsert import counts  # noqa: E402
+
+# (rows, affected, info, found_rows) -> (inserted, updated, unchanged)
+CASES = [
+    # Two duplicates, nothing changed
+    ((2, 0, 'Records: 2  Duplicates: 0  Warnings: 0', False), (0, 0, 2)),
+    # One insert, one changed update, one unchanged row
+    ((3, 3, 'Records: 3  Duplicates: 1  Warnings: 0', False), (1, 1, 1)),
+    # No-update upsert (col=col): one new row, one existing
+    ((2, 1, 'Records: 2  Duplicates: 0  Warnings: 0', False), (1, 0, 1)),
+    # Single rows, no info message
+    ((1, 1, None, False), (1, 0, 0)),
+    ((1, 2, None, False), (0, 1, 0)),
+    ((1, 0, None, False), (0, 0, 1)),
+    # CLIENT_FOUND_ROWS: one insert, one changed update, one unchanged row
+    ((3, 4, 'Records: 3  Duplicates: 2  Warnings: 0', True), (1, 1, 1)),
+    # Unknown
+    ((2, 2, None, False), None),
+]
+
+for args, expected in CASES:
+    got = counts(*args)
+    assert got == expected, "counts%r = %r, expected %r" % (args, got, expected)
+
+print("%d cases ok" % len(CASES))
@@ -13,6 +13,7 @@ CREATE TABLE IF NOT EXISTS google_users (
     suspended BOOLEAN DEFAULT FALSE,
     is_admin BOOLEAN DEFAULT FALSE,
     last_login_time DATETIME,
+    content_hash CHAR(64),
     synced_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
     INDEX idx_primary_email (primary_email),
     INDEX idx_external_id (external_id),
@@ -24,10 +25,24 @@ CREATE TABLE IF NOT EXISTS google_user_photos (
     user_id VARCHAR(255) PRIMARY KEY,
     photo_data MEDIUMBLOB,
     mime_type VARCHAR(50) DEFAULT 'image/jpeg',
+    content_hash CHAR(64),
     synced_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
     FOREIGN KEY (user_id) REFERENCES google_users(id) ON DELETE CASCADE
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
+-- Resized / WebP photo variants, rendered lazily from google_user_photos
+CREATE TABLE IF NOT EXISTS google_user_photo_variants (
+    user_id VARCHAR(255) NOT NULL,
+    size SMALLINT NOT NULL,
+    format VARCHAR(10) NOT NULL,
+    source_hash CHAR(64) NOT NULL,
+    photo_data MEDIUMBLOB,
+    mime_type VARCHAR(50),
+    synced_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    PRIMARY KEY (user_id, size, format),
+    FOREIGN KEY (user_id) REFERENCES google_users(id) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
 -- Sync log table to track sync operations
 CREATE TABLE IF NOT EXISTS google_sync_log (
     id INT AUTO_INCREMENT PRIMARY KEY,
@@ -35,6 +50,10 @@ CREATE TABLE IF NOT EXISTS google_sync_log (
     sync_status ENUM('started', 'completed', 'failed') NOT NULL,
     users_synced INT DEFAULT 0,
     photos_synced INT DEFAULT 0,
+    photos_failed INT DEFAULT 0,
+    users_inserted INT DEFAULT 0,
+    users_updated INT DEFAULT 0,
+    users_deleted INT DEFAULT 0,
     error_message TEXT,
     started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     completed_at TIMESTAMP NULL,
@@ -0,0 +1,29 @@
+-- Google Workspace Users Sync Tables: upgrade
+-- Brings tables created by an earlier google_users.sql up to date.
+-- Run once; statements for columns that already exist will fail harmlessly.
+
+-- Incremental user sync: stored content hash and per-sync change counts
+ALTER TABLE google_users ADD COLUMN content_hash CHAR(64) AFTER last_login_time;
+ALTER TABLE google_sync_log
+    ADD COLUMN users_inserted INT DEFAULT 0 AFTER photos_synced,
+    ADD COLUMN users_updated INT DEFAULT 0 AFTER users_inserted,
+    ADD COLUMN users_deleted INT DEFAULT 0 AFTER users_updated;
+
+-- Photos a photo sync could not store
+ALTER TABLE google_sync_log ADD COLUMN photos_failed INT DEFAULT 0 AFTER photos_synced;
+
+-- Photo ETags: stored content hash of each photo
+ALTER TABLE google_user_photos ADD COLUMN content_hash CHAR(64) AFTER mime_type;
+
+-- Resized / WebP photo variants, rendered lazily from google_user_photos
+CREATE TABLE IF NOT EXISTS google_user_photo_variants (
+    user_id VARCHAR(255) NOT NULL,
+    size SMALLINT NOT NULL,
+    format VARCHAR(10) NOT NULL,
+    source_hash CHAR(64) NOT NULL,
+    photo_data MEDIUMBLOB,
+    mime_type VARCHAR(50),
+    synced_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    PRIMARY KEY (user_id, size, format),
+    FOREIGN KEY (user_id) REFERENCES google_users(id) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;